@@ -0,0 +1,158 @@
+'''
+Headless batch runner: sends every chat request in a JSONL file through the same routing, rate limiting and
+token accounting as the Streamlit app and writes one JSON result per line as each request completes.
+
+Each input line is an object with "messages" and optionally "id", "engine", "temperature", "max_tokens",
+"top_p", "frequency_penalty", "presence_penalty" and "stop". Lines without an id are identified by their
+line number. Re-running with the same output file skips requests that already completed successfully.
+
+Example:
+    > python aoai_batch_runner.py prompts.jsonl results.jsonl --engine gpt-4-turbo --concurrency 8
+'''
+import argparse, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from src import aoai_helpers as helpers
+from src import aoai_router as router
+from src import aoai_rate_limiter as rate_limiter
+from src import aoai_usage as usage
+
+def read_requests(path):
+    '''
+    Yields (id, request) pairs from a JSONL file one line at a time, skipping blank lines.
+    '''
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            yield str(request.get("id", line_number)), request
+
+def completed_ids(path):
+    '''
+    Returns the ids already written to the output file without an error, so a rerun can resume.
+    '''
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by an interrupted run
+            if "error" not in result:
+                done.add(str(result["id"]))
+    return done
+
+def run_request(request_id, request, defaults, model_configs):
+    '''
+    Runs one chat request through the engine's router and returns its result record.
+    '''
+    engine = request.get("engine", defaults["engine"])
+    params = {**model_configs["common_params"], **model_configs.get(engine, {}), **defaults["rate_limits"]}
+    settings = {key: request.get(key, defaults[key]) for key in ("temperature", "max_tokens", "top_p", "frequency_penalty", "presence_penalty", "stop")}
+    messages = request["messages"]
+    result = {"id": request_id, "engine": engine}
+    start = time.monotonic()
+    try:
+        model = helpers.translate_engine_to_model(engine)
+        stream = router.get_router(engine, params).generate_chat_completion(messages=messages,
+                                                                            estimated_tokens=rate_limiter.estimate_request_tokens(messages, engine, settings["max_tokens"]),
+                                                                            **settings)
+        stream_usage = usage.StreamUsage(model, helpers.num_tokens_from_messages(messages, model))
+        parts = []
+        for chunk in stream:
+            stream_usage.add(chunk)
+            if chunk.choices:
+                parts.append(chunk.choices[0].delta.content or "")
+        result.update(response="".join(parts),
+                      prompt_tokens=stream_usage.prompt_tokens,
+                      completion_tokens=stream_usage.completion_tokens,
+                      usage_source=stream_usage.source)
+    except Exception as e:
+        # One bad request shouldn't stop the batch; it is recorded and retried on the next run
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency"] = round(time.monotonic() - start, 3)
+    return result
+
+def run_batch(input_path, output_path, defaults, concurrency=4, model_configs_path="configs/aoai_model_configs.json", progress_every=50):
+    '''
+    Runs every pending request in input_path with at most concurrency in flight, appending results to
+    output_path as they complete. Returns the run totals.
+    '''
+    model_configs = helpers.load_model_configs(model_configs_path)
+    done = completed_ids(output_path)
+    totals = {"completed": 0, "failed": 0, "skipped": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    lock = threading.Lock()
+    # Bounds the requests read ahead of the workers so the input file is never held in memory
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    start = time.monotonic()
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        def finish(future):
+            try:
+                record(future.result())
+            finally:
+                slots.release()
+
+        def record(result):
+            with lock:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                if "error" in result:
+                    totals["failed"] += 1
+                else:
+                    totals["completed"] += 1
+                    totals["prompt_tokens"] += result["prompt_tokens"]
+                    totals["completion_tokens"] += result["completion_tokens"]
+                finished = totals["completed"] + totals["failed"]
+                if progress_every and finished % progress_every == 0:
+                    print(f"{finished} requests finished, {finished / (time.monotonic() - start):.2f} requests/sec")
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+            for request_id, request in read_requests(input_path):
+                if request_id in done:
+                    totals["skipped"] += 1
+                    continue
+                slots.acquire()
+                pool.submit(run_request, request_id, request, defaults, model_configs).add_done_callback(finish)
+
+    totals["elapsed"] = round(time.monotonic() - start, 3)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of chat requests against Azure OpenAI.")
+    parser.add_argument("input", help="JSONL file of chat requests")
+    parser.add_argument("output", help="JSONL file results are appended to; also the checkpoint for resuming")
+    parser.add_argument("--engine", default="gpt-35-turbo-16k", help="engine for requests that don't set one")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum requests in flight")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=800)
+    parser.add_argument("--top-p", type=float, default=0.9)
+    parser.add_argument("--frequency-penalty", type=float, default=0.0)
+    parser.add_argument("--presence-penalty", type=float, default=0.0)
+    parser.add_argument("--requests-per-minute", type=int, help="override the configured requests/min limit per deployment")
+    parser.add_argument("--tokens-per-minute", type=int, help="override the configured tokens/min limit per deployment")
+    parser.add_argument("--configs", default="configs/aoai_model_configs.json", help="model configurations file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    defaults = {"engine": args.engine,
+                "temperature": args.temperature,
+                "max_tokens": args.max_tokens,
+                "top_p": args.top_p,
+                "frequency_penalty": args.frequency_penalty,
+                "presence_penalty": args.presence_penalty,
+                "stop": None,
+                "rate_limits": {key: value for key, value in (("requests_per_minute", args.requests_per_minute),
+                                                              ("tokens_per_minute", args.tokens_per_minute)) if value}}
+    totals = run_batch(args.input, args.output, defaults, concurrency=args.concurrency, model_configs_path=args.configs)
+    elapsed = max(totals["elapsed"], 1e-9)
+    print(f"Completed {totals['completed']}, failed {totals['failed']}, skipped {totals['skipped']} in {totals['elapsed']:.1f}s "
+          f"({totals['completed'] / elapsed:.2f} requests/sec)")
+    print(f"Prompt tokens: {totals['prompt_tokens']}, completion tokens: {totals['completion_tokens']} "
+          f"({totals['completion_tokens'] / elapsed:.1f} completion tokens/sec)")
+
+if __name__ == "__main__":
+    main()
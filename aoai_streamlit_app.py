@@ -1,21 +1,36 @@
 import os    
+import functools
+import time
+import openai
 import streamlit as st    
-import json    
+from streamlit.runtime.scriptrunner.script_runner import ScriptControlException
 from dotenv import load_dotenv      
-from openai import AzureOpenAI    
 from src import aoai_helpers as helpers    
+from src import aoai_context_budget as budget
+from src.aoai_history_view import HistoryView
+from src import aoai_rate_limiter as rate_limiter
+from src import aoai_router as router
+from src import aoai_response_cache as response_cache
+from src import aoai_compare as compare
+from src import aoai_telemetry as telemetry
+from src import aoai_tool_runner as tool_runner
+from src import aoai_tools_definitions as tool_definitions
+from src import aoai_conversation_store as conversation_store
+from src.aoai_streaming import FlushPolicy, StreamRenderer, TRUNCATION_MARKER
+from src.aoai_token_ledger import TokenLedger
+from src.aoai_usage import SessionUsage, StreamUsage
     
+# Time the whole rerun so the cost of rendering the sidebar and history is visible in the metrics
+rerun_start = time.perf_counter()
+telemetry_recorder = telemetry.get_telemetry()
+
 load_dotenv()      
     
 apim_key = os.environ['APIM_KEY']      
 apim_endpoint = os.environ['APIM_ENDPOINT']      
 version_of_api = os.environ['AOAI_API_VERSION']    
+bing_subscription_key = os.environ.get('BING_SEARCH_SUBSCRIPTION_KEY')
     
-client = AzureOpenAI(    
-  azure_endpoint=apim_endpoint,     
-  api_key=apim_key,      
-  api_version=version_of_api    
-)    
     
 # Create containers for the header, chat window, and footer - will use sidebar for setting model parameters    
 header_container = st.container()    
@@ -29,23 +44,34 @@ with header_container:
     st.title("Interact with an Azure OpenAI 🤖", anchor="top", help='''This demo showcases the Azure OpenAI Service, Azure API Management Service,    
           and Azure Web Apps with Streamlit.''')    
     
-# Initialize the client in the st.session_state    
-if 'client' not in st.session_state:    
-    st.session_state.client = client    
-    
 # Initialize 'engine' in session_state if not present  
 if 'engine' not in st.session_state:  
     st.session_state.engine = 'gpt-35-turbo-16k'  # Default value  
     
+# Load model configurations from JSON, only re-parsed when the file changes
+model_configs = helpers.load_model_configs("configs/aoai_model_configs.json")
+helpers.preload_encodings(tuple(m for m in model_configs if m != "common_params"))
+    
 # Pull up the messages if they exist - needed    
+# Conversations are persisted by the store and identified by ?conversation=<id>, so a refresh resumes where it left off.
+# Only the latest page is loaded; earlier pages are read back from the store when the user asks for them.
+store = conversation_store.get_conversation_store()
 if 'messages' not in st.session_state:    
     helpers.env_to_st_session_state('SYSTEM','system', standard_system_message)    
+    conversation_id = st.experimental_get_query_params().get('conversation', [None])[0]
+    if conversation_id is None or not store.exists(conversation_id):
+        conversation_id = store.create(st.session_state.system)
+        st.experimental_set_query_params(conversation=conversation_id)
+    st.session_state.conversation_id = conversation_id
+    st.session_state.system = store.load_system_message(conversation_id)
     st.session_state.messages = []    
     st.session_state.messages.append({"role":"system","content":st.session_state.system})    
-    
-# Load model configurations from JSON    
-with open("configs/aoai_model_configs.json", "r") as f:    
-    model_configs = json.load(f)    
+    st.session_state.messages.extend(store.load(conversation_id, limit=model_configs["common_params"]['history_page_size']))
+    st.session_state.conversation_next_seq = store.next_seq(conversation_id)
+residency = conversation_store.get_residency_tracker()
+residency.touch(st.session_state.conversation_id, st.session_state.messages)
+# Token usage of this session's requests, per turn and per deployment
+st.session_state.usage = st.session_state.get('usage', SessionUsage())
     
 with st.sidebar.title("Model Parameters", anchor="top", help='''The model parameters are used to control the behavior of the model.     
                       Each parameter has its own tooltip.'''):    
@@ -90,13 +116,51 @@ with st.sidebar.title("Model Parameters", anchor="top", help='''The model parame
                                                step=params['frequency_penalty_step'], help=params['frequency_penalty_help'], key="frequency_penaltykey")    
         presence_penalty = st.sidebar.slider("Set a Presence Penalty:", min_value=params['presence_penalty_min'], max_value=params['presence_penalty_max'], value=st.session_state.presence_penalty,    
                                              step=params['presence_penalty_step'], help=params['presence_penalty_help'], key="presence_penaltykey")    
+        # The sliders keep their own state under their keys; the request is built from these
+        st.session_state.temperature = temperature
+        st.session_state.max_tokens = max_tokens
+        st.session_state.top_p = top_p
+        st.session_state.frequency_penalty = frequency_penalty
+        st.session_state.presence_penalty = presence_penalty
+
+        # Controls how the history is fitted into the context window before each request
+        history_policy_name = st.sidebar.selectbox("History Policy:", list(budget.HISTORY_POLICIES.keys()), key="history_policykey",
+                                                   help=params['history_policy_help'])
+        st.session_state.history_policy = budget.HISTORY_POLICIES[history_policy_name]
+        if st.session_state.history_policy == "keep_first_last":
+            st.session_state.history_keep_first = st.sidebar.number_input("Keep First N Messages:", min_value=0, value=params['history_keep_first'],
+                                                                          step=1, help=params['history_keep_first_help'], key="history_keep_firstkey")
+            st.session_state.history_keep_last = st.sidebar.number_input("Keep Last M Messages:", min_value=1, value=params['history_keep_last'],
+                                                                         step=1, help=params['history_keep_last_help'], key="history_keep_lastkey")
     
+        st.session_state.use_response_cache = st.sidebar.checkbox("Cache Identical Requests", value=st.session_state.get('use_response_cache', False),
+                                                                  key="response_cachekey", help=params['response_cache_help'])
+        if st.session_state.use_response_cache:
+            cache_stats = response_cache.get_response_cache().stats
+            st.sidebar.caption(f"Cache hits: {cache_stats['memory_hits'] + cache_stats['disk_hits']}, misses: {cache_stats['misses']}, "
+                               f"hit rate: {response_cache.get_response_cache().hit_rate():.0%}")
+
+        # Web search is only offered when a Bing key is configured
+        st.session_state.use_web_search = bool(bing_subscription_key) and st.sidebar.checkbox("Enable Web Search", value=False, key="web_searchkey",
+                                                                                              help=params['web_search_help'])
+
+        compare_models = st.sidebar.checkbox("Compare Models", value=False, key="compare_modelskey", help=params['compare_models_help'])
+        st.session_state.compare_engines = []
+        if compare_models:
+            st.session_state.compare_engines = st.sidebar.multiselect("Models to Compare:", available_models, default=[model], key="compare_engineskey",
+                                                                      max_selections=4)
+
         if st.sidebar.button("Save Settings", key="saveButton", help='''Save the model parameter settings to the session state.''', type="primary"):        
+            st.session_state.system = system_message
+            helpers.save_session_state()
             st.sidebar.success('Settings saved successfully!', icon="✅")    
             
         if st.sidebar.button("Clear Chat History", key="mainChatClear", help='''Clear the chat history from the session state.''', type="secondary"):    
+            store.clear(st.session_state.conversation_id, standard_system_message)
+            st.session_state.conversation_next_seq = 1
             st.session_state.messages = []    
             st.session_state.messages.append({"role":"system","content":standard_system_message})    
+            residency.touch(st.session_state.conversation_id, st.session_state.messages)
             st.session_state["user_message"] = ""    
             st.session_state["assistant_message"] = ""    
             helpers.save_session_state()    
@@ -106,53 +170,266 @@ with st.sidebar.title("Model Parameters", anchor="top", help='''The model parame
         st.empty()    
         st.caption(f":red[_____________________________________]")    
         model = helpers.translate_engine_to_model(st.session_state.engine)    
-        system_tokens = helpers.num_tokens_from_messages([st.session_state.messages[0]], model)    
-        user_tokens = helpers.num_tokens_from_messages([msg for msg in st.session_state.messages if msg["role"] == "user"], model)    
-        assistant_tokens = helpers.num_tokens_from_messages([msg for msg in st.session_state.messages if msg["role"] == "assistant"], model)    
-        total_tokens = system_tokens + user_tokens + assistant_tokens    
+        token_count_start = time.perf_counter()
+        # The ledger memoizes per-message counts so a rerun only tokenizes messages it has not seen yet
+        if 'token_ledger' not in st.session_state:
+            st.session_state.token_ledger = TokenLedger(model)
+        token_totals = st.session_state.token_ledger.sync(st.session_state.messages, model).totals()
+        system_tokens = token_totals["system"]
+        user_tokens = token_totals["user"]
+        assistant_tokens = token_totals["assistant"]
+        total_tokens = token_totals["total"]
+        telemetry_recorder.observe("token_count_seconds", st.session_state.engine, time.perf_counter() - token_count_start)
     
         st.write(f"System tokens: {system_tokens}")    
         st.write(f"User tokens: {user_tokens}")    
         st.write(f"Assistant tokens: {assistant_tokens}")    
         st.write(f"Total tokens: {total_tokens}")    
     
-        max_tokens_progress = params['tokens_max']    
-        progress = total_tokens / max_tokens_progress    
-        st.progress(progress)    
+        # Progress against the full context window, clamped since the history may outgrow it before it is packed
+        progress = min(total_tokens / params['context_window'], 1.0)
+        st.progress(progress)
+
+        if 'budget_report' in st.session_state:
+            st.write(f"Tokens trimmed from last request: {st.session_state.budget_report['tokens_saved']}")
+        if st.session_state.usage.turns:
+            last_turn = st.session_state.usage.turns[-1]
+            if last_turn['source'] is None:
+                st.write("Last turn usage: no response was received")
+            elif last_turn['source'] == "cache":
+                st.write("Last turn usage: answered from the response cache, no tokens billed")
+            else:
+                st.write(f"Last turn usage ({last_turn['source']}): {last_turn['prompt_tokens']} prompt + {last_turn['completion_tokens']} completion tokens")
+
+    with st.sidebar.expander("Routing", expanded=False):
+        model_router = router.get_router(st.session_state.engine, params)
+        st.caption("Backends for the selected model, lowest score is preferred.")
+        st.dataframe(model_router.snapshot())
+        st.caption("Recent routing decisions")
+        st.dataframe(list(model_router.decisions)[::-1])
+
+    with st.sidebar.expander("Performance", expanded=False):
+        st.caption(f"Recent p50/p95 for {st.session_state.engine} across all sessions.")
+        st.dataframe(telemetry_recorder.registry.summary(deployment=st.session_state.engine))
+        st.caption("Your session's token usage")
+        st.dataframe(st.session_state.usage.summary())
+        if st.session_state.usage.records:
+            last_request = st.session_state.usage.records[-1]
+            st.caption("Your last request")
+            st.write({name: round(value, 3) if isinstance(value, float) else value for name, value in last_request.items() if name != "time"})
     
 with chat_container:    
-    if st.session_state['messages']:    
-        for message in st.session_state.messages:    
-            if message["role"] != "system":    
-                with st.chat_message(message["role"]):    
-                    st.markdown(message["content"])      
+    history_render_start = time.perf_counter()
+    # Only the latest page of the conversation is rendered; earlier pages load on request
+    if 'history_view' not in st.session_state:
+        st.session_state.history_view = HistoryView(page_size=params['history_page_size'])
+    history_view = st.session_state.history_view.sync(st.session_state.messages)
+    # The loaded messages are the most recent ones, so everything before them is still only in the store
+    stored_earlier = st.session_state.conversation_next_seq - len(st.session_state.messages)
+
+    def load_earlier_from_store():
+        earlier = store.load(st.session_state.conversation_id, before_seq=stored_earlier + 1, limit=history_view.page_size)
+        st.session_state.messages = st.session_state.messages[:1] + earlier + st.session_state.messages[1:]
+        history_view.load_earlier()
+
+    if history_view.hidden:
+        st.button(f"Load earlier messages ({history_view.hidden + stored_earlier} hidden)", key="loadEarlier", on_click=history_view.load_earlier,
+                  help="Show the previous page of the conversation.")
+    elif stored_earlier > 0:
+        st.button(f"Load earlier messages ({stored_earlier} hidden)", key="loadEarlier", on_click=load_earlier_from_store,
+                  help="Show the previous page of the conversation.")
+    if history_view.pages > 1:
+        st.button("Show latest messages only", key="showLatest", on_click=history_view.show_latest,
+                  help="Collapse the conversation back to the most recent page.")
+    for message in history_view.visible():
+        with st.chat_message(message["role"]):    
+            st.markdown(message["content"])      
+    telemetry_recorder.observe("history_render_seconds", st.session_state.engine, time.perf_counter() - history_render_start)
+
+    def keep_stopped_response(text):
+        '''
+        Keeps a response cut short by the Stop button or a disconnected session in the history, marked as stopped.
+        '''
+        st.session_state.messages.append({"role": "assistant", "content": text + TRUNCATION_MARKER})
+        st.session_state.conversation_next_seq = store.append(st.session_state.conversation_id, st.session_state.messages[-2:])
     
     if prompt := st.chat_input("💬 Window - Go ahead and type!"):    
         st.session_state.messages.append({"role": "user", "content": prompt})    
-        with st.chat_message("user"):    
-            st.markdown(prompt)    
-    
-        with st.chat_message("assistant"):    
-            message_placeholder = st.empty()    
-            full_response = ""    
-    
-            for response in helpers.generate_chat_completion(client=st.session_state.client,    
-                                                             engine=st.session_state.engine,    
-                                                             messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],    
-                                                            temperature=st.session_state.temperature,    
-                                                            max_tokens=st.session_state.max_tokens,    
-                                                            top_p=st.session_state.top_p,    
-                                                            frequency_penalty=st.session_state.frequency_penalty,    
-                                                            presence_penalty=st.session_state.presence_penalty,    
-                                                            stop=None,    
-                                                            stream=True):    
-    
-                if response.choices and len(response.choices) > 0:    
-                    full_response += response.choices[0].delta.content or ""    
-                message_placeholder.markdown(full_response + "▌")    
-            message_placeholder.markdown(full_response)    
-        st.session_state.messages.append({"role": "assistant", "content": full_response})    
+        prompt_message = st.session_state.messages[-1]
+        try:
+            turn = st.session_state.usage.start_turn()
+            with st.chat_message("user"):    
+                st.markdown(prompt)    
+    
+            if st.session_state.compare_engines:
+                # Fan the prompt out to every selected model at once, each streaming into its own column as tokens arrive
+                history = [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
+                st.button("Stop generating", key="stopGenerating", help="Stop the responses, keeping what has been written so far.")
+                columns = dict(zip(st.session_state.compare_engines, st.columns(len(st.session_state.compare_engines))))
+                streams, engine_models, renderers, metric_placeholders, prompt_tokens, stream_usages = {}, {}, {}, {}, {}, {}
+                for engine, column in columns.items():
+                    engine_params = {**model_configs["common_params"], **model_configs.get(engine, {})}
+                    engine_models[engine] = compare.completion_model(engine)
+                    engine_max_tokens = min(st.session_state.max_tokens, engine_params['tokens_max'])
+                    engine_messages, engine_report = budget.pack_messages(history,
+                                                                          model=engine_models[engine],
+                                                                          context_window=engine_params['context_window'],
+                                                                          max_tokens=engine_max_tokens,
+                                                                          policy=st.session_state.history_policy,
+                                                                          keep_first=st.session_state.get('history_keep_first', params['history_keep_first']),
+                                                                          keep_last=st.session_state.get('history_keep_last', params['history_keep_last']))
+                    column.markdown(f"**{engine}**")
+                    renderers[engine] = StreamRenderer(column.empty(), policy=FlushPolicy.from_env())
+                    metric_placeholders[engine] = column.empty()
+                    if not engine_report['fits']:
+                        metric_placeholders[engine].error(f"The conversation doesn't fit in {engine}'s context window.")
+                        continue
+                    prompt_tokens[engine] = engine_report['prompt_tokens']
+                    stream_usages[engine] = StreamUsage(engine_models[engine], engine_report['prompt_tokens'])
+                    streams[engine] = functools.partial(telemetry_recorder.timed_stream,
+                                                        functools.partial(router.get_router(engine, engine_params).generate_chat_completion,
+                                                                          messages=engine_messages,
+                                                                          temperature=st.session_state.temperature,
+                                                                          max_tokens=engine_max_tokens,
+                                                                          top_p=st.session_state.top_p,
+                                                                          frequency_penalty=st.session_state.frequency_penalty,
+                                                                          presence_penalty=st.session_state.presence_penalty,
+                                                                          stop=None,
+                                                                          estimated_tokens=engine_report['prompt_tokens'] + engine_max_tokens),
+                                                        deployment=engine,
+                                                        records=st.session_state.usage,
+                                                        stream_usage=stream_usages[engine])
+
+                # The conversation continues with the sidebar model's answer, or the first compared model's that finished
+                finished, failed = [], []
+                def pick_history_engine(candidates):
+                    if st.session_state.engine in candidates:
+                        return st.session_state.engine
+                    return next((engine for engine in st.session_state.compare_engines if engine in candidates), None)
+                events = compare.stream_many(streams, stream_usages)
+                try:
+                    for event, engine, payload in events:
+                        if event == "delta":
+                            renderers[engine].write(payload)
+                        elif event == "done":
+                            finished.append(engine)
+                            renderers[engine].close()
+                            ttft = "n/a" if payload['ttft'] is None else f"{payload['ttft']:.2f}s"
+                            metric_placeholders[engine].caption(f"TTFT: {ttft} | Total: {payload['latency']:.2f}s | "
+                                                                f"Prompt tokens: {prompt_tokens[engine]} | Completion tokens: {payload['completion_tokens']}")
+                        else:
+                            failed.append(engine)
+                            renderers[engine].close()
+                            metric_placeholders[engine].error(f"{engine} failed: {payload}")
+                except ScriptControlException:
+                    # Stop was clicked or the session went away: Streamlit interrupts the script at its next render
+                    history_engine = pick_history_engine([engine for engine in streams if engine not in failed])
+                    if history_engine is not None:
+                        keep_stopped_response(renderers[history_engine].text)
+                    raise
+                finally:
+                    events.close()
+                answer_engine = pick_history_engine(finished)
+                if answer_engine is None:
+                    # No model answered, so the prompt is dropped rather than followed by an empty answer
+                    st.session_state.messages.pop()
+                    full_response = None
+                else:
+                    full_response = renderers[answer_engine].text
+            else:
+                # Fit the history into the context window, leaving room for max_tokens of response
+                packed_messages, st.session_state.budget_report = budget.pack_messages([{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
+                                                                                       model=helpers.translate_engine_to_model(st.session_state.engine),
+                                                                                       context_window=params['context_window'],
+                                                                                       max_tokens=st.session_state.max_tokens,
+                                                                                       policy=st.session_state.history_policy,
+                                                                                       keep_first=st.session_state.get('history_keep_first', params['history_keep_first']),
+                                                                                       keep_last=st.session_state.get('history_keep_last', params['history_keep_last']))
+                if not st.session_state.budget_report['fits']:
+                    # Don't pay the upload latency for a request the service would reject
+                    st.error(f'''Your message needs {st.session_state.budget_report['prompt_tokens']} tokens but only {st.session_state.budget_report['budget']} are available
+                             after reserving Max Tokens per Response. Shorten the message or lower Max Tokens per Response.''')
+                    st.stop()
+
+                # The router picks a backend for the model; each backend's limiter queues concurrent sessions fairly for quota
+                model_router = router.get_router(st.session_state.engine, params)
+                tools = tool_definitions.tools if st.session_state.use_web_search else None
+                tool_functions = {"bing_web_search": tool_runner.make_bing_web_search_tool(bing_subscription_key)} if tools else {}
+                create_stream = lambda messages, tool_choice: telemetry_recorder.timed_stream(
+                    lambda: model_router.generate_chat_completion(messages=messages,
+                                                                  temperature=st.session_state.temperature,
+                                                                  max_tokens=st.session_state.max_tokens,
+                                                                  top_p=st.session_state.top_p,
+                                                                  frequency_penalty=st.session_state.frequency_penalty,
+                                                                  presence_penalty=st.session_state.presence_penalty,
+                                                                  stop=None,
+                                                                  estimated_tokens=rate_limiter.estimate_request_tokens(messages, st.session_state.engine, st.session_state.max_tokens),
+                                                                  tools=tools,
+                                                                  tool_choice=tool_choice if tools else None),
+                    deployment=st.session_state.engine,
+                    prompt_tokens=st.session_state.budget_report['prompt_tokens'],
+                    model=helpers.translate_engine_to_model(st.session_state.engine),
+                    records=st.session_state.usage)
+                # Identical deterministic requests are replayed from the cache through the same streaming path
+                if st.session_state.use_response_cache and not tools and response_cache.is_deterministic(st.session_state.temperature, st.session_state.top_p):
+                    key = response_cache.cache_key(st.session_state.engine, packed_messages, st.session_state.temperature, st.session_state.max_tokens,
+                                                   st.session_state.top_p, st.session_state.frequency_penalty, st.session_state.presence_penalty, None)
+                    uncached_stream = create_stream
+                    create_stream = lambda messages, tool_choice: response_cache.get_response_cache().completion(key, st.session_state.engine,
+                                                                                                                lambda: uncached_stream(messages, tool_choice),
+                                                                                                                on_hit=st.session_state.usage.record_cache_hit)
+
+                with st.chat_message("assistant"):    
+                    st.button("Stop generating", key="stopGenerating", help="Stop the response, keeping what has been written so far.")
+                    tool_placeholder = st.empty()
+                    renderer = StreamRenderer(st.empty(), policy=FlushPolicy.from_env())
+    
+                    # Tool calls the model makes are run concurrently and fed back until it produces its answer
+                    events = tool_runner.run_with_tools(create_stream, packed_messages, tool_functions)
+                    try:
+                        for event, payload in events:
+                            if event == "delta":
+                                renderer.write(payload)
+                            elif event == "tool_calls":
+                                tool_placeholder.caption("Searching the web: " + "; ".join(call["arguments"] for call in payload))
+                    except router.Router.FAILOVER_ERRORS as e:
+                        st.error(f"The service is busy right now, please try again in a moment. ({e})")
+                        st.stop()
+                    except openai.APIError as e:
+                        # e.g. a content filter 400 or an authentication error: show it rather than a traceback
+                        st.error(f"The request failed: {e}")
+                        st.stop()
+                    except ScriptControlException:
+                        # Stop was clicked or the session went away: Streamlit interrupts the script at its next render
+                        keep_stopped_response(renderer.text)
+                        raise
+                    finally:
+                        # Closes the upstream connection right away when the loop didn't run to the end
+                        events.close()
+                    tool_placeholder.empty()
+                    full_response = renderer.close()
+                    answer_engine = st.session_state.engine
+            if full_response is not None:
+                st.session_state.messages.append({"role": "assistant", "content": full_response})    
+                # Count the answer from the usage of the request that streamed it rather than encoding it again on the next rerun
+                answer_records = [record for record in turn["records"] if record["deployment"] == answer_engine]
+                if len(answer_records) == 1 and answer_records[0].get("completion_tokens"):
+                    st.session_state.token_ledger.append_completion(st.session_state.messages, answer_records[0]["completion_tokens"])
+                # The turn is written once, and older messages beyond the in-memory limit are left to the store
+                st.session_state.conversation_next_seq = store.append(st.session_state.conversation_id, st.session_state.messages[-2:])
+                st.session_state.messages = residency.cap(st.session_state.messages)
+                # Track the list now held, so an idle eviction trims the live history rather than the pre-cap copy
+                residency.touch(st.session_state.conversation_id, st.session_state.messages)
+        except BaseException:
+            # A turn that ends any other way than answered or stopped was never written to the store, so the prompt
+            # leaves the in-memory history too, keeping it in step with the store
+            if st.session_state.messages[-1] is prompt_message:
+                st.session_state.messages.pop()
+            raise
     
 with footer_container:    
     st.caption(f":red[______________________________________________________________________________________________]")    
-    st.caption(f":red[NOTE: ALL SYSTEM MESSAGES, PROMPTS, AND COMPLETIONS ARE LOGGED FOR THIS DEMO. DO NOT ENTER ANY SENSITIVE INFORMATION.]")    
+    st.caption(f":red[NOTE: ALL SYSTEM MESSAGES, PROMPTS, AND COMPLETIONS ARE LOGGED FOR THIS DEMO. DO NOT ENTER ANY SENSITIVE INFORMATION.]")
+
+telemetry_recorder.observe("rerun_seconds", st.session_state.engine, time.perf_counter() - rerun_start)
+    
@@ -0,0 +1,69 @@
+'''
+Fills and benchmarks the tiktoken cache directory shipped with the app, so token counting never downloads BPE
+files at runtime.
+
+"download" loads the encoding of every model in helpers.ENGINE_MODELS into the cache directory (tiktoken_cache/ by
+default, or TIKTOKEN_CACHE_DIR), fetching whatever is missing. Run it wherever there is network access, e.g. in the
+build before the app is packaged. "benchmark" measures the cold start: each run is a fresh process that loads
+every encoding from the cache, and the timings are reported with their percentiles.
+
+Example:
+    > python aoai_tiktoken_cache.py download
+    > python aoai_tiktoken_cache.py benchmark --runs 5
+'''
+import argparse, json, os, subprocess, sys, time
+from src import aoai_helpers as helpers
+from src import aoai_telemetry as telemetry
+
+# Run in a fresh interpreter so nothing is cached in memory yet
+COLD_START = '''
+import json, time
+start = time.perf_counter()
+from src import aoai_helpers as helpers
+imported = time.perf_counter()
+timings = helpers.warm_up_encodings()
+print(json.dumps({"import_seconds": imported - start, "warmup_seconds": time.perf_counter() - imported, "models": timings}))
+'''
+
+def download():
+    '''
+    Loads every model's encoding, downloading missing BPE files into the cache directory, and returns the timings.
+    '''
+    os.makedirs(os.environ['TIKTOKEN_CACHE_DIR'], exist_ok=True)
+    return helpers.warm_up_encodings()
+
+def benchmark(runs=5):
+    '''
+    Times loading every encoding from the cache in runs fresh processes. Raises CalledProcessError if a run fails,
+    e.g. because the cache is incomplete and there is no network access.
+    '''
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", COLD_START], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), env=os.environ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill or benchmark the local tiktoken cache.")
+    parser.add_argument("command", choices=["download", "benchmark"])
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to time for benchmark")
+    args = parser.parse_args()
+
+    print(f"Cache directory: {os.environ['TIKTOKEN_CACHE_DIR']}")
+    if args.command == "download":
+        start = time.perf_counter()
+        timings = download()
+        print(f"Cached {len(timings)} models' encodings in {time.perf_counter() - start:.2f}s: {', '.join(timings)}")
+        return
+
+    results = benchmark(args.runs)
+    for name in ("import_seconds", "warmup_seconds"):
+        values = [result[name] for result in results]
+        print(f"{name}: p50 {telemetry.quantile(values, 0.5):.3f}s, p95 {telemetry.quantile(values, 0.95):.3f}s, "
+              f"max {max(values):.3f}s over {len(values)} runs")
+    slowest = max(results, key=lambda result: result["warmup_seconds"])
+    print("Slowest warm-up by model: " + ", ".join(f"{model} {seconds:.3f}s" for model, seconds in slowest["models"].items()))
+
+if __name__ == "__main__":
+    main()
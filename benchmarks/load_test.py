@@ -0,0 +1,126 @@
+'''
+Load generator: simulates concurrent chat sessions driving the app's request path (history packing, routing and
+rate limiting, the streamed completion with telemetry, and the streaming render loop) and reports time to first
+token, total latency and throughput percentiles.
+
+By default the requests go to an in-process stub endpoint (see stub_aoai_server.py) shaped by the same options
+as the stub's command line; pass --endpoint to target a running stub or a real deployment instead, with APIM_KEY
+and AOAI_API_VERSION set as for the app.
+
+Example:
+    > python -m benchmarks.load_test --sessions 20 --turns 5 --rate-limit-fraction 0.05
+'''
+import argparse, os, threading, time
+from src import aoai_helpers as helpers
+from src import aoai_context_budget as budget
+from src import aoai_rate_limiter as rate_limiter
+from src import aoai_router as router
+from src import aoai_telemetry as telemetry
+from src.aoai_streaming import FlushPolicy, StreamRenderer
+from benchmarks.microbenchmarks import NullPlaceholder
+from benchmarks import stub_aoai_server as stub
+
+REPORT_QUANTILES = (0.5, 0.95, 0.99)
+
+def run_session(session_id, engine, params, turns, max_tokens, think_time, recorder, records, errors):
+    '''
+    One simulated user: sends turns prompts in a growing conversation, rendering each answer as the app does.
+    '''
+    model = helpers.translate_engine_to_model(engine)
+    messages = [{"role": "system", "content": "You are an AI assistant that helps people."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Session {session_id}, question {turn}: " + "please explain " * 20})
+        packed_messages, report = budget.pack_messages(messages, model=model, context_window=params['context_window'], max_tokens=max_tokens,
+                                                       policy="sliding_window")
+        model_router = router.get_router(engine, params)
+        renderer = StreamRenderer(NullPlaceholder(), policy=FlushPolicy.from_env())
+        try:
+            stream = recorder.timed_stream(lambda: model_router.generate_chat_completion(messages=packed_messages,
+                                                                                         temperature=0.7,
+                                                                                         max_tokens=max_tokens,
+                                                                                         top_p=0.9,
+                                                                                         frequency_penalty=0.0,
+                                                                                         presence_penalty=0.0,
+                                                                                         stop=None,
+                                                                                         estimated_tokens=rate_limiter.estimate_request_tokens(packed_messages, engine, max_tokens)),
+                                           deployment=engine, prompt_tokens=report['prompt_tokens'], model=model, records=records)
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    renderer.write(chunk.choices[0].delta.content)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            messages.pop()
+            continue
+        messages.append({"role": "assistant", "content": renderer.close()})
+        time.sleep(think_time)
+
+def run_load(sessions, turns, engine, params, max_tokens=800, think_time=0.0, ramp_up=0.0):
+    '''
+    Runs the sessions concurrently and returns (records, errors, elapsed seconds).
+    '''
+    recorder = telemetry.Telemetry()
+    records, errors = [], []
+    threads = [threading.Thread(target=run_session, args=(i, engine, params, turns, max_tokens, think_time, recorder, records, errors),
+                                name=f"session-{i}") for i in range(sessions)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+        time.sleep(ramp_up / max(sessions, 1))
+    for thread in threads:
+        thread.join()
+    return records, errors, time.monotonic() - start
+
+def report(records, errors, elapsed):
+    completed = [record for record in records if not record.get("error")]
+    completion_tokens = sum(record.get("completion_tokens") or 0 for record in completed)
+    print(f"Requests: {len(records)} completed {len(completed)}, errors {len(errors)} in {elapsed:.2f}s "
+          f"({len(completed) / elapsed:.2f} requests/sec, {completion_tokens / elapsed:.1f} completion tokens/sec)")
+    print(f"{'metric':<32}" + "".join(f"{'p' + str(int(q * 100)):>10}" for q in REPORT_QUANTILES) + f"{'max':>10}")
+    for name in ("ttft_seconds", "total_seconds", "completion_tokens_per_second"):
+        values = [record[name] for record in completed if record.get(name) is not None]
+        if values:
+            print(f"{name:<32}" + "".join(f"{telemetry.quantile(values, q):>10.3f}" for q in REPORT_QUANTILES) + f"{max(values):>10.3f}")
+    for error in sorted(set(errors))[:10]:
+        print(f"  error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent chat sessions and report TTFT and throughput percentiles.")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated sessions")
+    parser.add_argument("--turns", type=int, default=3, help="prompts per session")
+    parser.add_argument("--engine", default="gpt-35-turbo-16k")
+    parser.add_argument("--max-tokens", type=int, default=800)
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds a session waits between prompts")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which sessions are started")
+    parser.add_argument("--requests-per-minute", type=int, default=100000, help="limiter requests/min per deployment")
+    parser.add_argument("--tokens-per-minute", type=int, default=100000000, help="limiter tokens/min per deployment")
+    parser.add_argument("--endpoint", help="endpoint to load instead of the in-process stub")
+    parser.add_argument("--configs", default="configs/aoai_model_configs.json", help="model configurations file")
+    stub.add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    if args.endpoint:
+        os.environ['APIM_ENDPOINT'] = args.endpoint
+    else:
+        config = stub.config_from_args(args)
+        server = stub.start_stub_server(config)
+        os.environ['APIM_ENDPOINT'] = f"http://127.0.0.1:{server.server_port}"
+        os.environ.setdefault('APIM_KEY', 'stub')
+        os.environ.setdefault('AOAI_API_VERSION', '2023-12-01-preview')
+
+    model_configs = helpers.load_model_configs(args.configs)
+    params = {**model_configs["common_params"], **model_configs.get(args.engine, {}),
+              "requests_per_minute": args.requests_per_minute, "tokens_per_minute": args.tokens_per_minute,
+              "max_queued_requests": max(args.sessions, model_configs["common_params"]['max_queued_requests'])}
+    helpers.warm_up_encodings([helpers.translate_engine_to_model(args.engine)])
+
+    records, errors, elapsed = run_load(args.sessions, args.turns, args.engine, params, args.max_tokens, args.think_time, args.ramp_up)
+    report(records, errors, elapsed)
+    for backend in router.get_router(args.engine, params).backends:
+        print(f"Limiter {backend.name}: {backend.limiter.stats}")
+    if server is not None:
+        print(f"Stub: {config.stats}")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
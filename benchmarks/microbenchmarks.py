@@ -0,0 +1,97 @@
+'''
+Micro-benchmarks for the hot paths of a chat turn: counting a conversation's tokens, building the Bing results
+table, and the streaming render loop. Each case is timed over several repeats and reported per call.
+
+Token counting needs the tiktoken encodings in the local cache (see aoai_tiktoken_cache.py).
+
+Example:
+    > python -m benchmarks.microbenchmarks --repeat 7
+'''
+import argparse, time
+from src import aoai_helpers as helpers
+from src import aoai_bing_search as bing_search
+from src import aoai_telemetry as telemetry
+from src.aoai_streaming import FlushPolicy, StreamRenderer
+from src.aoai_token_ledger import TokenLedger
+
+class NullPlaceholder:
+    '''
+    Stands in for st.empty() so the render loop is timed without a browser; counts what would be sent.
+    '''
+    def __init__(self):
+        self.renders = 0
+        self.chars = 0
+
+    def markdown(self, text):
+        self.renders += 1
+        self.chars += len(text)
+
+def conversation(turns, words_per_message=60):
+    messages = [{"role": "system", "content": "You are an AI assistant that helps people."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": " ".join(f"question{turn}-{i}" for i in range(words_per_message))})
+        messages.append({"role": "assistant", "content": " ".join(f"answer{turn}-{i}" for i in range(words_per_message))})
+    return messages
+
+def bing_results(count):
+    return {"webPages": {"value": [{"name": f"Result {i} <b>&</b> more",
+                                    "url": f"https://example.com/{i}",
+                                    "snippet": f"Snippet {i} with <strong>highlighted</strong> text\nspanning lines " * 3,
+                                    "dateLastCrawled": "2024-01-01T00:00:00.0000000Z"} for i in range(count)]}}
+
+def measure(func, number, repeat):
+    '''
+    Returns the seconds per call of func over repeat runs of number calls each.
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+def render_loop(deltas, policy):
+    renderer = StreamRenderer(NullPlaceholder(), policy=policy)
+    for delta in deltas:
+        renderer.write(delta)
+    return renderer.close()
+
+def cases(turns, results, deltas):
+    '''
+    Returns (name, callable, calls per repeat) for every benchmark case.
+    '''
+    model = helpers.translate_engine_to_model("gpt-35-turbo-16k")
+    messages = conversation(turns)
+    ledger = TokenLedger(model).sync(messages, model)
+    raw_results = bing_results(results)
+    items = bing_search.parse_results(raw_results)
+    stream = ["tok "] * deltas
+    return [
+        (f"num_tokens_from_messages ({len(messages)} messages)", lambda: helpers.num_tokens_from_messages(messages, model), 5),
+        (f"TokenLedger.sync, nothing new ({len(messages)} messages)", lambda: ledger.sync(messages, model).totals(), 1000),
+        (f"bing parse + html table ({results} results)", lambda: bing_search.render_results(bing_search.parse_results(raw_results), "html"), 200),
+        (f"bing markdown table ({results} results)", lambda: bing_search.render_results(items, "markdown"), 200),
+        (f"render loop, default flush policy ({deltas} deltas)", lambda: render_loop(stream, FlushPolicy()), 20),
+        (f"render loop, flush every delta ({deltas} deltas)", lambda: render_loop(stream, FlushPolicy(flush_interval=0, flush_chars=1)), 5),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the token counting, search rendering and streaming render hot paths.")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repeats per case")
+    parser.add_argument("--turns", type=int, default=50, help="conversation turns for the token counting cases")
+    parser.add_argument("--results", type=int, default=50, help="search results for the table cases")
+    parser.add_argument("--deltas", type=int, default=2000, help="streamed deltas for the render loop cases")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    helpers.warm_up_encodings()
+    print(f"Encoding warm-up: {time.perf_counter() - start:.3f}s")
+    print(f"{'case':<60} {'p50 ms':>10} {'min ms':>10} {'max ms':>10}")
+    for name, func, number in cases(args.turns, args.results, args.deltas):
+        func()  # warm-up call
+        timings = measure(func, number, args.repeat)
+        print(f"{name:<60} {telemetry.quantile(timings, 0.5) * 1000:>10.3f} {min(timings) * 1000:>10.3f} {max(timings) * 1000:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+'''
+Local stand-in for an Azure OpenAI chat completions endpoint, for benchmarks and load tests. Every POST is
+answered with a generated completion, streamed as server-sent events when the request asks for a stream.
+
+The response shape is configurable: how many chunks, how many characters each carries, the delay before the
+first chunk and between chunks, and which requests are rejected with a 429 and a retry-after-ms header: a
+fraction chosen at random, and/or the first few requests the stub receives.
+A usage chunk is sent at the end when the request sets stream_options.include_usage.
+
+Example:
+    > python -m benchmarks.stub_aoai_server --port 8080 --chunks 200 --chunk-delay-ms 10 --rate-limit-fraction 0.05
+    then point APIM_ENDPOINT at http://127.0.0.1:8080
+'''
+import argparse, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubConfig:
+    '''
+    Shape of the stub's responses. Delays are in seconds.
+    '''
+    def __init__(self, chunks=100, chunk_chars=4, first_chunk_delay=0.2, chunk_delay=0.01, rate_limit_fraction=0.0,
+                 retry_after_ms=500, seed=None, rate_limit_first=0):
+        self.chunks = chunks
+        self.chunk_chars = chunk_chars
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.rate_limit_fraction = rate_limit_fraction
+        self.retry_after_ms = retry_after_ms
+        self.rate_limit_first = rate_limit_first
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "rate_limited": 0, "completed": 0, "disconnected": 0}
+        self.lock = threading.Lock()
+
+def _chunk(model, delta, finish_reason=None):
+    return {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+def make_handler(config):
+    '''
+    Builds the request handler class serving responses shaped by config.
+    '''
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with config.lock:
+                config.stats["requests"] += 1
+                rate_limited = (config.stats["requests"] <= config.rate_limit_first
+                                or config.random.random() < config.rate_limit_fraction)
+                if rate_limited:
+                    config.stats["rate_limited"] += 1
+            if rate_limited:
+                self._send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded. (stub)"}},
+                                {"retry-after-ms": str(config.retry_after_ms), "retry-after": str(max(config.retry_after_ms // 1000, 1))})
+                return
+
+            model = request.get("model", "stub")
+            pieces = ["x" * (config.chunk_chars - 1) + " " for _ in range(config.chunks)]
+            time.sleep(config.first_chunk_delay)
+            if not request.get("stream"):
+                self._send_json(200, {"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                                      "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": "stop"}],
+                                      "usage": {"prompt_tokens": 0, "completion_tokens": config.chunks, "total_tokens": config.chunks}})
+                with config.lock:
+                    config.stats["completed"] += 1
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            events = [_chunk(model, {"role": "assistant", "content": ""})]
+            events += [_chunk(model, {"content": piece}) for piece in pieces]
+            events.append(_chunk(model, {}, "stop"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                events.append({**_chunk(model, {}), "choices": [],
+                               "usage": {"prompt_tokens": 0, "completion_tokens": config.chunks, "total_tokens": config.chunks}})
+            try:
+                for i, event in enumerate(events):
+                    if 1 < i <= config.chunks:
+                        time.sleep(config.chunk_delay)
+                    self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading, e.g. a cancelled response
+                with config.lock:
+                    config.stats["disconnected"] += 1
+                return
+            with config.lock:
+                config.stats["completed"] += 1
+
+        def _write_chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    '''
+    Starts the stub on a background thread and returns the server; its endpoint is
+    f"http://{host}:{server.server_port}". Port 0 picks a free port.
+    '''
+    server = ThreadingHTTPServer((host, port), make_handler(config or StubConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-aoai", daemon=True).start()
+    return server
+
+def add_config_arguments(parser):
+    parser.add_argument("--chunks", type=int, default=100, help="content chunks per response")
+    parser.add_argument("--chunk-chars", type=int, default=4, help="characters per content chunk")
+    parser.add_argument("--first-chunk-delay-ms", type=float, default=200, help="delay before the first chunk")
+    parser.add_argument("--chunk-delay-ms", type=float, default=10, help="delay between chunks")
+    parser.add_argument("--rate-limit-fraction", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--rate-limit-first", type=int, default=0, help="answer the first N requests with a 429")
+    parser.add_argument("--retry-after-ms", type=int, default=500, help="retry-after-ms sent with each 429")
+    parser.add_argument("--seed", type=int, help="seed for choosing which requests are rate limited")
+
+def config_from_args(args):
+    return StubConfig(chunks=args.chunks,
+                      chunk_chars=args.chunk_chars,
+                      first_chunk_delay=args.first_chunk_delay_ms / 1000,
+                      chunk_delay=args.chunk_delay_ms / 1000,
+                      rate_limit_fraction=args.rate_limit_fraction,
+                      retry_after_ms=args.retry_after_ms,
+                      seed=args.seed,
+                      rate_limit_first=args.rate_limit_first)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stub Azure OpenAI chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    config = config_from_args(args)
+    server = start_stub_server(config, args.host, args.port)
+    print(f"Stub endpoint listening on http://{args.host}:{server.server_port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(config.stats)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
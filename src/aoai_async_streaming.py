@@ -0,0 +1,76 @@
+import asyncio, queue, threading
+from src.aoai_shared import shared
+
+# ############################################################
+# Cancellable streaming on a background event loop
+# ############################################################
+_END = object()
+
+class CancellableStream:
+    '''
+    Runs an async chat completion stream on the background event loop and hands its chunks to the calling
+    thread as a plain iterator, so the rest of the request path stays synchronous.
+
+    close() cancels the stream from any thread: the task reading the response is cancelled and the upstream
+    connection closed right away, rather than reading the rest of the completion the service is generating.
+    It is also called when iteration ends or is abandoned, e.g. when the generator consuming it is closed.
+
+    Args:
+        open_stream (callable): Returns a coroutine that opens the stream, e.g. an AsyncAzureOpenAI
+            chat.completions.create(..., stream=True) call. Errors opening it, such as 429s, are raised by the
+            constructor so rate limiting and failover see them before any chunk is read.
+    '''
+    def __init__(self, open_stream, loop=None):
+        self._loop = loop or get_event_loop()
+        self._chunks = queue.Queue()
+        self.cancelled = False
+        self._stream = asyncio.run_coroutine_threadsafe(open_stream(), self._loop).result()
+        self._task = asyncio.run_coroutine_threadsafe(self._pump(), self._loop)
+
+    async def _pump(self):
+        try:
+            async for chunk in self._stream:
+                self._chunks.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._chunks.put(e)
+        finally:
+            await self._stream.response.aclose()
+            self._chunks.put(_END)
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._chunks.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._task.done():
+            self.cancelled = True
+            self._task.cancel()
+            # Closed separately too, in case the task is cancelled before it gets to run
+            asyncio.run_coroutine_threadsafe(self._stream.response.aclose(), self._loop)
+
+def _start_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="aoai-event-loop", daemon=True).start()
+    return loop
+
+def get_event_loop():
+    '''
+    Returns the process-wide event loop async clients run on, starting its thread on first use.
+    '''
+    return shared("event_loop", _start_event_loop)
+
+def run(coroutine, timeout=None):
+    '''
+    Runs a coroutine on the background event loop and waits for its result.
+    '''
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result(timeout)
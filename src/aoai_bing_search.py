@@ -0,0 +1,132 @@
+import html, json, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from src.aoai_shared import shared
+
+# ############################################################
+# Bing Web Search client
+# ############################################################
+BING_SEARCH_URL = "https://api.bing.microsoft.com/v7.0/search"
+OUTPUT_FORMATS = ("html", "markdown", "text", "structured")
+
+def parse_results(results):
+    '''
+    Flattens a Bing Web Search response into a list of dicts with name, url, snippet, last_updated and type.
+    '''
+    return [{"name": item.get("name", "N/A"),
+             "url": item.get("url", "N/A"),
+             "snippet": item.get("snippet", "N/A").replace("\n", " "),
+             "last_updated": item.get("dateLastCrawled", "N/A")[:10],  # Extract just the date
+             "type": "Web page"}  # In this context, all results are web pages
+            for item in results.get("webPages", {}).get("value", [])]
+
+def render_results(items, output_format="html"):
+    '''
+    Renders parsed results as an HTML table, a Markdown table, or compact plain text for a model to read.
+    Rows are collected in a list and joined once rather than concatenated row by row.
+    '''
+    if output_format == "html":
+        rows = ["<table><tr><th>Name (URL)</th><th>Snippet</th><th>Last Updated</th><th>Type</th></tr>"]
+        for item in items:
+            rows.append(f"<tr><td><a href='{item['url']}'>{html.escape(item['name'])}</a></td>"
+                        f"<td>{html.escape(item['snippet'], quote=False)}</td><td>{item['last_updated']}</td><td>{item['type']}</td></tr>")
+        rows.append("</table>")
+        return "".join(rows)
+    if output_format == "markdown":
+        rows = ["Name (URL) | Snippet | Last Updated | Type", "--- | --- | --- | ---"]
+        for item in items:
+            # Convert highlight tags from HTML to Markdown if present
+            snippet = item["snippet"].replace('<strong>', '**').replace('</strong>', '**')
+            rows.append(f"[{html.escape(item['name'])}]({item['url']}) | {snippet} | {item['last_updated']} | {item['type']}")
+        return "\n".join(rows) + "\n"
+    if output_format == "text":
+        return "\n".join(f"{item['name']} ({item['url']}, {item['last_updated']}): "
+                         f"{item['snippet'].replace('<strong>', '').replace('</strong>', '')}" for item in items)
+    raise ValueError(f"Unknown output format {output_format}. Please use one of the following: {list(OUTPUT_FORMATS)}")
+
+class BingSearchClient:
+    '''
+    Bing Web Search client with a persistent connection pool, a TTL cache of raw results keyed on the query and
+    its parameters, and a batch API that runs many queries concurrently.
+    '''
+    def __init__(self, api_key, base_url=None, timeout=10.0, cache_ttl=300.0, cache_size=256, pool_size=10):
+        self.base_url = base_url or os.environ.get('BING_SEARCH_ENDPOINT', BING_SEARCH_URL)
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.pool_size = pool_size
+        self.stats = {"hits": 0, "misses": 0}
+        self.session = requests.Session()
+        self.session.headers["Ocp-Apim-Subscription-Key"] = api_key
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fetch(self, query, **kwargs):
+        '''
+        Returns the raw JSON response for a query, from the cache when an identical query was made within cache_ttl.
+        Raises requests.exceptions.RequestException on failure; failures are not cached.
+        '''
+        params = {"q": query, **kwargs}
+        key = json.dumps(params, sort_keys=True, default=str)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[0] <= self.cache_ttl:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+        response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json()
+        with self._lock:
+            self._cache[key] = (now, results)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+    def search(self, query, output_format="html", **kwargs):
+        '''
+        Searches and renders the results in output_format ('html', 'markdown', 'text' or 'structured', which
+        returns the list of result dicts without rendering). Errors are returned as a message string.
+        '''
+        try:
+            results = self.fetch(query, **kwargs)
+        except requests.exceptions.HTTPError as err:
+            return f"HTTP Error: {err}"
+        except requests.exceptions.RequestException as e:
+            return f"Error: {e}"
+
+        if 'webPages' not in results:
+            return "No results found or the query was invalid."
+        items = parse_results(results)
+        return items if output_format == "structured" else render_results(items, output_format)
+
+    def search_many(self, queries, output_format="html", max_workers=None, **kwargs):
+        '''
+        Runs several searches concurrently over the shared connection pool and returns their results in order.
+        Each query is either a string or a dict with "query" and any per-query parameters; kwargs apply to all.
+        '''
+        def run(query):
+            if isinstance(query, dict):
+                query = dict(query)
+                return self.search(query.pop("query"), output_format, **{**kwargs, **query})
+            return self.search(query, output_format, **kwargs)
+
+        if not queries:
+            return []
+        with ThreadPoolExecutor(max_workers=max_workers or min(len(queries), self.pool_size), thread_name_prefix="bing") as pool:
+            return list(pool.map(run, queries))
+
+def get_bing_client(api_key, base_url=None):
+    '''
+    Returns the process-wide search client for an API key and endpoint, creating it on first use.
+    '''
+    base_url = base_url or os.environ.get('BING_SEARCH_ENDPOINT', BING_SEARCH_URL)
+    return shared(("bing_client", api_key, base_url), lambda: BingSearchClient(api_key, base_url=base_url))
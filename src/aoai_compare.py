@@ -0,0 +1,77 @@
+import queue, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from src import aoai_helpers as helpers
+
+# ############################################################
+# Concurrent multi-model comparison
+# ############################################################
+def _run_stream(name, create, events, start, stream_usage, stop):
+    '''
+    Worker body: opens one stream, forwards its deltas to the events queue and reports timing and the completion
+    tokens stream_usage counted. The stream is closed as soon as stop is set.
+    '''
+    metrics = {"ttft": None, "latency": None, "completion_tokens": 0}
+    try:
+        stream = create()
+        for chunk in stream:
+            if stop.is_set():
+                stream.close()
+                return
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if metrics["ttft"] is None:
+                    metrics["ttft"] = time.monotonic() - start
+                events.put(("delta", name, delta))
+        metrics["latency"] = time.monotonic() - start
+        if stream_usage is not None and stream_usage.completion_tokens is not None:
+            metrics["completion_tokens"] = stream_usage.completion_tokens
+        events.put(("done", name, metrics))
+    except Exception as e:
+        metrics["latency"] = time.monotonic() - start
+        events.put(("error", name, e))
+
+def stream_many(streams, usages=None, max_workers=None):
+    '''
+    Runs several streaming completions concurrently and yields their events in arrival order, so wall-clock
+    time is that of the slowest stream rather than the sum of all of them.
+
+    Args:
+        streams (dict): Name -> zero-argument callable returning a chat completion stream.
+        usages (dict): Optional name -> aoai_usage.StreamUsage the stream counts its tokens into as it goes
+            (see Telemetry.timed_stream), read for completion_tokens so the answer is not encoded again.
+        max_workers (int): Thread pool size, defaults to one thread per stream.
+
+    Yields:
+        tuple: ("delta", name, text) as text arrives, then ("done", name, metrics) with ttft, latency and
+        completion_tokens, or ("error", name, exception), once per stream.
+    '''
+    usages = usages or {}
+    events = queue.Queue()
+    start = time.monotonic()
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max_workers or len(streams) or 1, thread_name_prefix="compare")
+    try:
+        for name, create in streams.items():
+            pool.submit(_run_stream, name, create, events, start, usages.get(name), stop)
+        remaining = len(streams)
+        # Only the calling thread yields, so Streamlit elements are never touched from the workers
+        while remaining:
+            event = events.get()
+            if event[0] != "delta":
+                remaining -= 1
+            yield event
+    finally:
+        # Don't hold the caller up if it stops consuming early, e.g. on a Streamlit rerun, but stop the streams
+        stop.set()
+        pool.shutdown(wait=False)
+
+def completion_model(engine):
+    '''
+    Returns the tiktoken model for an engine, or None if the engine is unknown and its tokens can't be counted.
+    '''
+    try:
+        return helpers.translate_engine_to_model(engine)
+    except KeyError:
+        return None
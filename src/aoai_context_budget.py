@@ -0,0 +1,82 @@
+from src.aoai_token_ledger import message_tokens
+
+# ############################################################
+# Context window budget helpers
+# ############################################################
+REPLY_PRIMING_TOKENS = 3  # every reply is primed with <|start|>assistant<|message|>
+
+# History policies offered in the sidebar, display name -> policy key
+HISTORY_POLICIES = {"Sliding window": "sliding_window",
+                    "Keep first and last": "keep_first_last"}
+
+def prompt_budget(context_window, max_tokens):
+    '''
+    Returns the number of tokens available for the prompt once the response allowance is reserved.
+    '''
+    return max(context_window - max_tokens, 0)
+
+def _drop_oldest(pinned, history, budget, model, protected=()):
+    '''
+    Drops the oldest messages of history until pinned + history fits in budget. Messages whose index is in
+    protected are never dropped, so the oldest unprotected ones go first. Returns the kept history and its
+    token count.
+    '''
+    counts = [message_tokens(m, model) for m in history]
+    total = sum(message_tokens(m, model) for m in pinned) + sum(counts) + REPLY_PRIMING_TOKENS
+    keep = [True] * len(history)
+    for i in range(len(history)):
+        if total <= budget:
+            break
+        if i in protected:
+            continue
+        keep[i] = False
+        total -= counts[i]
+    # A reply without the question that prompted it only confuses the model, so never keep one that leads
+    # the history or follows a dropped message
+    for i in range(len(history)):
+        if keep[i] and i not in protected and history[i]["role"] == "assistant" and (i == 0 or not keep[i - 1]):
+            keep[i] = False
+            total -= counts[i]
+    return [m for m, k in zip(history, keep) if k], total
+
+def pack_messages(messages, model, context_window, max_tokens, policy="sliding_window", keep_first=2, keep_last=20):
+    '''
+    Fits a chat history into the model's context window so that prompt + max_tokens does not overflow it.
+
+    The system message is pinned and the newest message (the prompt being answered) is always kept.
+    With the 'sliding_window' policy the oldest turns are dropped first. With 'keep_first_last' only the
+    first keep_first and last keep_last messages are considered; if they still do not fit, the oldest of the
+    last keep_last go first, and the first keep_first are only dropped if that is not enough.
+
+    Returns the packed message list and a report dict with prompt_tokens, original_prompt_tokens,
+    tokens_saved, messages_dropped, budget and fits.
+    '''
+    if policy not in HISTORY_POLICIES.values():
+        raise ValueError(f"Unknown history policy {policy}. Please use one of the following: {list(HISTORY_POLICIES.values())}")
+
+    pinned = [m for m in messages[:1] if m["role"] == "system"]
+    history = list(messages[len(pinned):])
+    original_tokens = sum(message_tokens(m, model) for m in messages) + REPLY_PRIMING_TOKENS
+    budget = prompt_budget(context_window, max_tokens)
+
+    if policy == "keep_first_last":
+        keep_last = max(keep_last, 1)
+        if len(history) > keep_first + keep_last:
+            history = history[:keep_first] + history[-keep_last:]
+
+    protected = {len(history) - 1} if history else set()
+    if policy == "keep_first_last":
+        kept, prompt_tokens = _drop_oldest(pinned, history, budget, model, protected | set(range(min(keep_first, len(history)))))
+        if prompt_tokens > budget:
+            kept, prompt_tokens = _drop_oldest(pinned, history, budget, model, protected)
+    else:
+        kept, prompt_tokens = _drop_oldest(pinned, history, budget, model, protected)
+    packed = pinned + kept
+
+    report = {"prompt_tokens": prompt_tokens,
+              "original_prompt_tokens": original_tokens,
+              "tokens_saved": original_tokens - prompt_tokens,
+              "messages_dropped": len(messages) - len(packed),
+              "budget": budget,
+              "fits": prompt_tokens <= budget}
+    return packed, report
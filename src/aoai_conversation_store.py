@@ -0,0 +1,154 @@
+import os, sqlite3, threading, time, uuid
+from src.aoai_shared import shared
+
+# ############################################################
+# Persistent conversation store
+# ############################################################
+class ConversationStore:
+    '''
+    Append-only SQLite store of conversations. Each message is written once as its own row, keyed by
+    conversation and sequence number (the system message is sequence 0), so saving a turn never rewrites
+    the history and any page of it can be read back on its own.
+    '''
+    def __init__(self, db_path="conversations.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS conversations (id TEXT PRIMARY KEY, created REAL NOT NULL, updated REAL NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages (conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                         "content TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (conversation_id, seq))")
+        self._db.commit()
+
+    def create(self, system_message):
+        '''
+        Starts a new conversation with the given system message and returns its id.
+        '''
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT INTO conversations (id, created, updated) VALUES (?, ?, ?)", (conversation_id, now, now))
+            self._db.execute("INSERT INTO messages (conversation_id, seq, role, content, created) VALUES (?, 0, 'system', ?, ?)",
+                             (conversation_id, system_message, now))
+            self._db.commit()
+        return conversation_id
+
+    def exists(self, conversation_id):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone() is not None
+
+    def append(self, conversation_id, messages):
+        '''
+        Writes messages, e.g. a user message and its answer, in one transaction after the last stored message,
+        and returns the sequence number the next message will be written at.
+        '''
+        now = time.time()
+        with self._lock:
+            first_seq = self._db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE conversation_id = ?", (conversation_id,)).fetchone()[0]
+            self._db.executemany("INSERT INTO messages (conversation_id, seq, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                                 [(conversation_id, first_seq + offset, message["role"], message["content"], now)
+                                  for offset, message in enumerate(messages)])
+            self._db.execute("UPDATE conversations SET updated = ? WHERE id = ?", (now, conversation_id))
+            self._db.commit()
+        return first_seq + len(messages)
+
+    def set_system_message(self, conversation_id, content):
+        with self._lock:
+            self._db.execute("UPDATE messages SET content = ? WHERE conversation_id = ? AND seq = 0", (content, conversation_id))
+            self._db.commit()
+
+    def next_seq(self, conversation_id):
+        '''
+        Returns the sequence number the next message of the conversation will be written at.
+        '''
+        with self._lock:
+            row = self._db.execute("SELECT MAX(seq) FROM messages WHERE conversation_id = ?", (conversation_id,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def load(self, conversation_id, before_seq=None, limit=20):
+        '''
+        Returns up to limit messages (excluding the system message) preceding before_seq, or the most
+        recent ones if before_seq is None, oldest first.
+        '''
+        with self._lock:
+            rows = self._db.execute("SELECT role, content FROM messages WHERE conversation_id = ? AND seq > 0 AND seq < ? "
+                                    "ORDER BY seq DESC LIMIT ?",
+                                    (conversation_id, before_seq if before_seq is not None else 2 ** 62, limit)).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def load_system_message(self, conversation_id):
+        with self._lock:
+            row = self._db.execute("SELECT content FROM messages WHERE conversation_id = ? AND seq = 0", (conversation_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def clear(self, conversation_id, system_message):
+        '''
+        Deletes every message of the conversation and resets its system message.
+        '''
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE conversation_id = ? AND seq > 0", (conversation_id,))
+            self._db.execute("UPDATE messages SET content = ? WHERE conversation_id = ? AND seq = 0", (system_message, conversation_id))
+            self._db.execute("UPDATE conversations SET updated = ? WHERE id = ?", (time.time(), conversation_id))
+            self._db.commit()
+
+# ############################################################
+# In-memory residency of active conversations
+# ############################################################
+class ResidencyTracker:
+    '''
+    Keeps track of the in-memory message list of every active session so that memory stays bounded for a
+    long-lived server: lists are capped at max_messages as turns are added, and lists of sessions idle for
+    idle_seconds are trimmed to their last keep_messages. Idle lists can only be trimmed in place, which
+    TokenLedger and HistoryView notice by the identity of their last message. Trimmed messages remain in the store and are paged back in on demand.
+    Lists always hold the system message followed by a contiguous run of the most recent messages.
+    '''
+    def __init__(self, max_messages=200, idle_seconds=900.0, keep_messages=20):
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self.keep_messages = keep_messages
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _trim(messages, keep):
+        excess = len(messages) - 1 - keep
+        if excess > 0:
+            del messages[1:1 + excess]
+
+    def cap(self, messages):
+        '''
+        Returns messages without its oldest messages beyond max_messages, never dropping the system message.
+        The list is copied rather than trimmed in place so anything tracking it sees a new list; touch the
+        session again with the returned list so idle eviction trims the list the session holds.
+        '''
+        if len(messages) - 1 <= self.max_messages:
+            return messages
+        return messages[:1] + messages[len(messages) - self.max_messages:]
+
+    def touch(self, conversation_id, messages):
+        '''
+        Marks a session's conversation as active and trims the lists of sessions that have gone idle.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[conversation_id] = (now, messages)
+            for other_id, (last_active, other_messages) in list(self._sessions.items()):
+                if now - last_active > self.idle_seconds:
+                    # The idle session isn't running, so its list can be trimmed in place
+                    self._trim(other_messages, self.keep_messages)
+                    del self._sessions[other_id]
+
+def get_conversation_store():
+    '''
+    Returns the process-wide conversation store at CONVERSATION_DB (default conversations.db).
+    '''
+    return shared("conversation_store", lambda: ConversationStore(os.environ.get('CONVERSATION_DB', 'conversations.db')))
+
+def get_residency_tracker():
+    '''
+    Returns the process-wide residency tracker, configured from CONVERSATION_MAX_MESSAGES_IN_MEMORY (default 200)
+    and CONVERSATION_IDLE_SECONDS (default 900).
+    '''
+    return shared("residency_tracker",
+                  lambda: ResidencyTracker(max_messages=int(os.environ.get('CONVERSATION_MAX_MESSAGES_IN_MEMORY', 200)),
+                                           idle_seconds=float(os.environ.get('CONVERSATION_IDLE_SECONDS', 900))))
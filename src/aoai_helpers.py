@@ -1,16 +1,63 @@
-import os, requests, html, tiktoken
+import os, json, time, httpx, tiktoken
 import streamlit as st
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+from src import aoai_async_streaming as async_streaming
+from src import aoai_bing_search as bing_search
+from src import aoai_conversation_store as conversation_store
 
 # ############################################################
 # Azure OpenAI helper functions
 # ############################################################
-def generate_chat_completion(client, engine, messages, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, stop, stream):
+@st.cache_resource(show_spinner=False)
+def get_async_aoai_client(azure_endpoint, api_key, api_version, max_connections=None, max_keepalive_connections=None, keepalive_expiry=None):
     '''
-    Generates a chat completion based on the provided messages.
+    Returns the process-wide AsyncAzureOpenAI client for an endpoint, backed by a pooled HTTP client so every
+    session and rerun reuses the same keep-alive connections instead of paying a new TLS handshake. Its requests
+    run on the background event loop (see aoai_async_streaming), so streams can be cancelled mid-response.
+    Pool limits default to the AOAI_MAX_CONNECTIONS, AOAI_MAX_KEEPALIVE_CONNECTIONS and
+    AOAI_KEEPALIVE_EXPIRY environment variables.
     '''
-    try:
-        response = client.chat.completions.create(
+    limits = httpx.Limits(max_connections=max_connections or int(os.environ.get('AOAI_MAX_CONNECTIONS', 100)),
+                          max_keepalive_connections=max_keepalive_connections or int(os.environ.get('AOAI_MAX_KEEPALIVE_CONNECTIONS', 20)),
+                          keepalive_expiry=keepalive_expiry or float(os.environ.get('AOAI_KEEPALIVE_EXPIRY', 30.0)))
+    http_client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(600.0, connect=5.0))
+    return AsyncAzureOpenAI(azure_endpoint=azure_endpoint,
+                            api_key=api_key,
+                            api_version=api_version,
+                            http_client=http_client)
+
+def generate_chat_completion(client, engine, messages, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, stop, stream,
+                             limiter=None, estimated_tokens=0, tools=None, tool_choice=None):
+    '''
+    Generates a chat completion based on the provided messages. Tool definitions and tool_choice are
+    only sent when given.
+
+    If a limiter (see aoai_rate_limiter.DeploymentLimiter) is given, the request waits for requests/min and
+    estimated_tokens tokens/min of quota and is retried on 429s, honoring Retry-After, by the limiter
+    rather than by the client.
+
+    The client is an AsyncAzureOpenAI client (see get_async_aoai_client). The call still blocks until the
+    response starts, but a stream is returned as an aoai_async_streaming.CancellableStream whose close()
+    stops it mid-response.
+
+    If AOAI_STREAM_USAGE is set, streams ask for a final usage chunk with the billed token counts
+    (stream_options.include_usage, which needs API version 2024-09-01-preview or later).
+    '''
+    tool_params = {}
+    if tools is not None:
+        tool_params["tools"] = tools
+    if tool_choice is not None:
+        tool_params["tool_choice"] = tool_choice
+    if stream and os.environ.get('AOAI_STREAM_USAGE'):
+        tool_params["extra_body"] = {"stream_options": {"include_usage": True}}
+
+    def create(client):
+        if stream:
+            return async_streaming.CancellableStream(lambda: request(client))
+        return async_streaming.run(request(client))
+
+    def request(client):
+        return client.chat.completions.create(
             model=engine,
             messages=messages,
             temperature=temperature,
@@ -19,14 +66,17 @@ def generate_chat_completion(client, engine, messages, temperature, max_tokens,
             frequency_penalty=frequency_penalty,
             presence_penalty=presence_penalty,
             stop=stop,
-            stream=stream
+            stream=stream,
+            **tool_params
         )
-        return response
-    except AzureOpenAI.error.RateLimitError as e:
-        raise e
+
+    if limiter is None:
+        return create(client)
+    no_retry_client = client.with_options(max_retries=0)
+    return limiter.call(lambda: create(no_retry_client), estimated_tokens)
 
 # Bing Search helper function
-def bing_web_search(api_key, query: str, output_format: str ='html', **kwargs) -> str:
+def bing_web_search(api_key, query: str, output_format: str ='html', **kwargs) -> str | list:
     """
     Perform a search using the Bing Web Search v7.0 API with error handling, support for various query parameters and
     advanced search keywords in the query. Outputs a string that can be displayed in either Markdown or HTML table format
@@ -35,12 +85,16 @@ def bing_web_search(api_key, query: str, output_format: str ='html', **kwargs) -
     Args:
         api_key (str): The API key for accessing the Bing Web Search API.
         query (str): The user's search query term. Must not be empty.
-        output_format (str): The format of the output, either 'markdown' or 'html'. Default is 'html'.
+        output_format (str): The format of the output, either 'markdown', 'html', 'text' (compact lines for a model to read)
+        or 'structured' (the list of result dicts, skipping rendering). Default is 'html'.
         **kwargs: Arbitrary keyword arguments representing additional query parameters supported by the API.
         advanced key words found here: https://support.microsoft.com/en-us/topic/advanced-search-keywords-ea595928-5d63-4a0b-9c6b-0b769865e78a
 
     Returns:
-        str: A table with the search results in the specified format or an error message, including additional details.
+        str | list: A table with the search results in the specified format or an error message, including additional
+        details. With output_format='structured' it is the list of result dicts (name, url, snippet, last_updated
+        and type) instead, unless the search failed, which still returns the message string.
+        Results are cached per query and parameters, and requests reuse a pooled connection (see aoai_bing_search).
 
     Example:
         >>> api_key = 'YOUR_BING_API_KEY'
@@ -48,96 +102,74 @@ def bing_web_search(api_key, query: str, output_format: str ='html', **kwargs) -
         >>> output = bing_web_search(api_key, query, output_format='html', count=50, mkt='en-US')
         >>> display(HTML(output))
     """  
-    base_url = "https://api.bing.microsoft.com/v7.0/search"  
-    headers = {"Ocp-Apim-Subscription-Key": api_key}  
-    params = {"q": query}  
-    params.update(kwargs)  
-  
-    try:  
-        response = requests.get(base_url, headers=headers, params=params)  
-        response.raise_for_status()  
-    except requests.exceptions.HTTPError as err:  
-        return f"HTTP Error: {err}"  
-    except requests.exceptions.RequestException as e:  
-        return f"Error: {e}"  
-  
-    results = response.json()  
-  
-    if 'webPages' not in results:  
-        return "No results found or the query was invalid."  
-  
-    if output_format == 'markdown':  
-        table = "Name (URL) | Snippet | Last Updated | Type\n"  
-        table += "--- | --- | --- | ---\n"  
-    elif output_format == 'html':  
-        table = "<table><tr><th>Name (URL)</th><th>Snippet</th><th>Last Updated</th><th>Type</th></tr>"  
-  
-    for item in results.get("webPages", {}).get("value", []):  
-        name = html.escape(item.get("name", "N/A"))  
-        url = item.get("url", "N/A")  
-        snippet = item.get("snippet", "N/A").replace("\n", " ")  
-        last_updated = item.get("dateLastCrawled", "N/A")[:10]  # Extract just the date  
-        result_type = "Web page"  # In this context, all results are web pages  
-          
-        # Handle snippet highlighting  
-        if output_format == 'html':  
-            snippet = html.escape(snippet, quote=False)  
-        else:  # For Markdown, convert highlight tags from HTML to Markdown if present  
-            snippet = snippet.replace('<strong>', '**').replace('</strong>', '**')  
-          
-        # Format the name and URL as a clickable link  
-        if output_format == 'html':  
-            link = f"<a href='{url}'>{name}</a>"  
-        else:  # Markdown  
-            link = f"[{name}]({url})"  
-          
-        # Build the table row  
-        if output_format == 'markdown':  
-            table += f"{link} | {snippet} | {last_updated} | {result_type}\n"  
-        elif output_format == 'html':  
-            table += f"<tr><td>{link}</td><td>{snippet}</td><td>{last_updated}</td><td>{result_type}</td></tr>"  
-  
-    table += "</table>" if output_format == 'html' else ""  
-  
-    return table
+    return bing_search.get_bing_client(api_key).search(query, output_format=output_format, **kwargs)
+
+# ############################################################
+# Model configuration helper functions
+# ############################################################
+# Parsed model configs keyed by path, each stored with the file mtime it was parsed at
+_MODEL_CONFIGS = {}
+
+def load_model_configs(path="configs/aoai_model_configs.json"):
+    '''
+    Returns the parsed model configurations, re-reading the file only when its mtime changes.
+    The returned dict is shared across sessions and must not be modified.
+    '''
+    mtime = os.path.getmtime(path)
+    cached = _MODEL_CONFIGS.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r") as f:
+            cached = (mtime, json.load(f))
+        _MODEL_CONFIGS[path] = cached
+    return cached[1]
 
 # ############################################################
 # Tiktoken helper functions
 # ############################################################
+# Engine (deployment) name -> model name used for tiktoken token counts
+ENGINE_MODELS = {"gpt-35-turbo-0301" : "gpt-3.5-turbo",
+                 "gpt-35-turbo-0613" : "gpt-3.5-turbo",
+                 "gpt-35-turbo-1106" : "gpt-3.5-turbo",
+                 "gpt-35-turbo-16k" : "gpt-3.5-turbo-16k-0613",
+                 "gpt-4" : "gpt-4-0613",
+                 "gpt-4-32k" : "gpt-4-32k-0613",
+                 "gpt-4-turbo" : "gpt-4-32k-0613"}
+
 def translate_engine_to_model(engine):
     '''
     Translates the engine name to the model name for use with 
     tiktoken.encoding_for_model for token tracking.
     '''
-    try:
-        engine_model_dict = {"gpt-35-turbo-0301" : "gpt-3.5-turbo",
-							 "gpt-35-turbo-0613" : "gpt-3.5-turbo",
-							 "gpt-35-turbo-1106" : "gpt-3.5-turbo",
-							 "gpt-35-turbo-16k" : "gpt-3.5-turbo-16k-0613",
-							 "gpt-4" : "gpt-4-0613",
-							 "gpt-4-32k" : "gpt-4-32k-0613",
-							 "gpt-4-turbo" : "gpt-4-32k-0613"}
-        model = engine_model_dict.get(engine)
-        if model is None:
-            raise KeyError(f"Engine {engine} not found. Please use one of the following: {list(engine_model_dict.keys())}")
-        return model
-    except KeyError:
-        engine_model_dict = {"gpt-35-turbo-0301" : "gpt-3.5-turbo",
-							 "gpt-35-turbo-0613" : "gpt-3.5-turbo",
-							 "gpt-35-turbo-1106" : "gpt-3.5-turbo",
-							 "gpt-35-turbo-16k" : "gpt-3.5-turbo-16k-0613",
-							 "gpt-4" : "gpt-4-0613",
-							 "gpt-4-32k" : "gpt-4-32k-0613",
-							 "gpt-4-turbo" : "gpt-4-32k-0613"}
-        raise KeyError(f"Engine {engine} not found. Please use one of the following: {list(engine_model_dict.keys())}")
+    model = ENGINE_MODELS.get(engine)
+    if model is None:
+        raise KeyError(f"Engine {engine} not found. Please use one of the following: {list(ENGINE_MODELS.keys())}")
+    return model
 
-def num_tokens_from_messages(messages, model):
-    """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+# BPE files are read from a cache directory shipped with the app (filled by aoai_tiktoken_cache.py) rather than
+# downloaded on first use, which is slow on a fresh container and fails without outbound network access
+TIKTOKEN_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tiktoken_cache")
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", TIKTOKEN_CACHE_DIR)
+
+# Encoders are expensive to build (BPE file load and parse), so keep one per model for the life of the process
+_ENCODINGS = {}
+
+def get_encoding(model):
+    """Return a cached tiktoken encoding for the given model, falling back to cl100k_base."""
+    encoding = _ENCODINGS.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            print("Warning: model not found. Using cl100k_base encoding.")
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _ENCODINGS[model] = encoding
+    return encoding
+
+def message_token_params(model):
+    """
+    Return (model, tokens_per_message, tokens_per_name) for the given model, where model is the
+    concrete model the counts are computed against.
+    """
     if model in {
         "gpt-3.5-turbo",
         "gpt-3.5-turbo-16k-0613",
@@ -146,21 +178,69 @@ def num_tokens_from_messages(messages, model):
         "gpt-4-0613",
         "gpt-4-32k-0613",
         }:
-        tokens_per_message = 3
-        tokens_per_name = 1
+        return model, 3, 1
     elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
+        # every message follows <|start|>{role/name}\n{content}<|end|>\n and if there's a name, the role is omitted
+        return model, 4, -1
     elif "gpt-3.5-turbo" in model:
         print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
+        return message_token_params("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
         print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return num_tokens_from_messages(messages, model="gpt-4-0613")
+        return message_token_params("gpt-4-0613")
     else:
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
+
+def num_tokens_from_message(message, model):
+    """Return the number of tokens used by a single message, excluding the reply priming tokens."""
+    model, tokens_per_message, tokens_per_name = message_token_params(model)
+    encoding = get_encoding(model)
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+def warm_up_encodings(models=None):
+    '''
+    Loads the encoding of every model (by default every model in ENGINE_MODELS) into the per-process cache
+    and returns how long each took in seconds. Models sharing an encoding only pay for it once.
+    '''
+    timings = {}
+    for model in dict.fromkeys(models or ENGINE_MODELS.values()):
+        start = time.perf_counter()
+        get_encoding(model)
+        timings[model] = time.perf_counter() - start
+    return timings
+
+@st.cache_resource(show_spinner=False)
+def preload_encodings(engines):
+    '''
+    Loads the tiktoken encoding for every engine up front, once per process, so the first
+    token count in a session doesn't pay for it.
+    '''
+    models = []
+    for engine in engines:
+        try:
+            models.append(translate_engine_to_model(engine))
+        except KeyError as e:
+            print(f"Warning: {e}")
+    try:
+        timings = warm_up_encodings(models)
+    except Exception as e:
+        print(f"Warning: could not load tiktoken encodings from {os.environ['TIKTOKEN_CACHE_DIR']} ({e}). "
+              "Run python aoai_tiktoken_cache.py download to fill it.")
+        return 0
+    print(f"Loaded {len(_ENCODINGS)} tiktoken encodings in {sum(timings.values()):.2f}s")
+    return len(_ENCODINGS)
+
+def num_tokens_from_messages(messages, model):
+    """Return the number of tokens used by a list of messages."""
+    model, tokens_per_message, tokens_per_name = message_token_params(model)
+    encoding = get_encoding(model)
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
@@ -218,7 +298,6 @@ def toggle_settings():
 
 def save_session_state():  
     # Update this function to only save variables that are used and initialized within the app  
-    st.session_state.client = st.session_state.client  
     st.session_state.engine = st.session_state.engine  
     st.session_state.temperature = st.session_state.temperature  
     st.session_state.max_tokens = st.session_state.max_tokens  
@@ -229,3 +308,6 @@ def save_session_state():
     # Update the system message in the first message if it is of type 'system'  
     if st.session_state.messages and st.session_state.messages[0]['role'] == 'system':  
         st.session_state.messages[0]['content'] = st.session_state.system  
+        # Persist it too, the rest of the conversation is already in the store
+        if 'conversation_id' in st.session_state:
+            conversation_store.get_conversation_store().set_system_message(st.session_state.conversation_id, st.session_state.system)
@@ -0,0 +1,60 @@
+# ############################################################
+# Windowed chat history view
+# ############################################################
+class HistoryView:
+    '''
+    Tracks which messages of a conversation are displayable and which of them are currently shown.
+
+    Only the most recent page_size messages are shown until the user asks for earlier pages. The index of
+    displayable (non-system) messages is kept incrementally, like the token ledger, so a rerun costs
+    O(visible window) rather than a pass over the whole conversation.
+    '''
+    def __init__(self, page_size=20):
+        self.page_size = page_size
+        self.pages = 1
+        self._messages = None
+        self._length = 0
+        self._last = None
+        self._indices = []
+
+    def sync(self, messages):
+        '''
+        Brings the index up to date with the message list, only looking at messages appended since the last sync.
+        A replaced, shortened or front-trimmed list is re-indexed; a shortened or trimmed one also sends the view
+        back to the latest page, while a longer replacement, e.g. with earlier messages paged in from the store,
+        keeps the pages shown.
+        '''
+        shortened = len(messages) < self._length
+        trimmed = (messages is self._messages and not shortened and self._length > 0
+                   and messages[self._length - 1] is not self._last)
+        if messages is not self._messages or shortened or trimmed:
+            if shortened or trimmed:
+                self.pages = 1
+            self._messages = messages
+            self._length = 0
+            self._indices = []
+        for index in range(self._length, len(messages)):
+            if messages[index]["role"] != "system":
+                self._indices.append(index)
+        self._length = len(messages)
+        self._last = messages[-1] if messages else None
+        return self
+
+    @property
+    def hidden(self):
+        '''
+        Number of displayable messages before the visible window.
+        '''
+        return max(len(self._indices) - self.pages * self.page_size, 0)
+
+    def visible(self):
+        '''
+        Returns the messages in the visible window, oldest first.
+        '''
+        return [self._messages[index] for index in self._indices[self.hidden:]]
+
+    def load_earlier(self):
+        self.pages += 1
+
+    def show_latest(self):
+        self.pages = 1
@@ -0,0 +1,200 @@
+import random, threading, time
+from collections import deque
+from email.utils import parsedate_to_datetime
+import openai
+from src import aoai_helpers as helpers
+from src.aoai_shared import shared
+from src.aoai_token_ledger import message_tokens
+
+# ############################################################
+# Client-side rate limiting and retry scheduling
+# ############################################################
+class RateLimitQueueFullError(Exception):
+    '''
+    Raised when a deployment already has the maximum number of requests waiting for quota.
+    '''
+
+class TokenBucket:
+    '''
+    A token bucket holding up to capacity units that refills continuously at capacity per period seconds.
+    Not thread safe on its own; DeploymentLimiter serializes access.
+    '''
+    def __init__(self, capacity, period=60.0, clock=time.monotonic):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.clock = clock
+        self.available = self.capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        '''
+        Returns how many seconds until amount units are available, 0 if they are available now.
+        Requests larger than the bucket only wait for it to be full so they can't block forever.
+        '''
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+class DeploymentLimiter:
+    '''
+    Requests/min and tokens/min limits for one deployment, with a bounded FIFO admission queue.
+
+    Callers are admitted strictly in arrival order: only the request at the head of the queue may take
+    quota, so a burst from one session can't starve the others. When the service answers 429 the whole
+    deployment is paused for the Retry-After period.
+    '''
+    def __init__(self, requests_per_minute, tokens_per_minute, max_queue=32, max_retries=5, base_delay=1.0, max_delay=60.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.requests = TokenBucket(requests_per_minute, clock=clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock)
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = {"admitted": 0, "rejected": 0, "throttled": 0, "retries": 0}
+        self._condition = threading.Condition()
+        self._waiters = deque()
+        self._paused_until = 0.0
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def acquire(self, estimated_tokens, timeout=None):
+        '''
+        Blocks until one request and estimated_tokens tokens of quota are available, in FIFO order.
+        Raises RateLimitQueueFullError if the queue is full and TimeoutError if timeout seconds pass first.
+        '''
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._condition:
+            if len(self._waiters) >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise RateLimitQueueFullError(f"{len(self._waiters)} requests are already waiting for quota. Please try again shortly.")
+            ticket = object()
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] is ticket:
+                        wait = max(self._paused_until - self.clock(),
+                                   self.requests.wait_time(1),
+                                   self.tokens.wait_time(estimated_tokens))
+                        if wait <= 0:
+                            self.requests.consume(1)
+                            self.tokens.consume(estimated_tokens)
+                            self.stats["admitted"] += 1
+                            return
+                    if deadline is not None:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            raise TimeoutError("Timed out waiting for rate limit quota.")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+            finally:
+                # Admitted or given up, either way the next waiter may now be at the head of the queue
+                self._waiters.remove(ticket)
+                self._condition.notify_all()
+
+    def pause(self, seconds):
+        '''
+        Stops admitting requests for the given number of seconds, e.g. after a 429 with Retry-After.
+        '''
+        with self._condition:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+            self.stats["throttled"] += 1
+            self._condition.notify_all()
+
+    def paused_remaining(self):
+        '''
+        Seconds left of a pause set after a 429, 0 if requests are being admitted.
+        '''
+        with self._condition:
+            return max(self._paused_until - self.clock(), 0.0)
+
+    def quota_remaining(self):
+        '''
+        Fraction of the tokens/min bucket currently available.
+        '''
+        with self._condition:
+            self.tokens.wait_time(0)
+            return max(self.tokens.available, 0.0) / self.tokens.capacity
+
+    def call(self, func, estimated_tokens, timeout=None):
+        '''
+        Calls func once admitted, retrying on 429s, timeouts, connection errors and 5xx responses with the
+        larger of Retry-After and a jittered exponential backoff. Re-raises the last error when retries run out.
+        '''
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens, timeout=timeout)
+            try:
+                return func()
+            except (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                self.stats["retries"] += 1
+                if isinstance(e, openai.RateLimitError):
+                    # Every caller for this deployment waits out the throttle, not just this one
+                    self.pause(delay)
+                else:
+                    self.sleep(delay)
+
+def retry_after_seconds(error):
+    '''
+    Reads the Retry-After delay from a rate limit error's response headers, None if it has none.
+    '''
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    '''
+    Full-jitter exponential backoff: a random delay between 0 and base_delay * 2**attempt, capped at max_delay.
+    '''
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def estimate_request_tokens(messages, engine, max_tokens):
+    '''
+    Estimates the tokens a request counts against tokens/min the way the service does: prompt tokens plus max_tokens.
+    '''
+    try:
+        model = helpers.translate_engine_to_model(engine)
+    except KeyError:
+        model = "gpt-4-0613"
+    prompt_tokens = sum(message_tokens(m, model) for m in messages if isinstance(m.get("content"), str)) + 3
+    return prompt_tokens + (max_tokens or 0)
+
+def get_limiter(deployment, requests_per_minute, tokens_per_minute, max_queue=32, **kwargs):
+    '''
+    Returns the process-wide limiter for a deployment, creating it on first use. Extra keyword
+    arguments are passed to DeploymentLimiter.
+    '''
+    return shared(("limiter", deployment),
+                  lambda: DeploymentLimiter(requests_per_minute, tokens_per_minute, max_queue, **kwargs))
@@ -0,0 +1,145 @@
+import hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+from src.aoai_shared import shared
+
+# ############################################################
+# Completion response cache
+# ############################################################
+def is_deterministic(temperature, top_p):
+    '''
+    Only requests sampled greedily are worth caching; anything else is expected to vary between calls.
+    '''
+    return temperature == 0 or top_p == 0
+
+def cache_key(engine, messages, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, stop):
+    '''
+    Builds the cache key for a request from its normalized messages, engine and sampling parameters.
+    Surrounding whitespace in message content is not significant.
+    '''
+    normalized = [[m["role"], (m.get("content") or "").strip(), m.get("name")] for m in messages]
+    payload = json.dumps([engine, normalized, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, stop],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def replay_chunks(content, engine, piece_size=64):
+    '''
+    Replays a cached response as ChatCompletionChunk objects so callers consume a hit exactly like a live stream.
+    '''
+    created = int(time.time())
+    for i in range(0, len(content), piece_size):
+        yield ChatCompletionChunk(id="cache", object="chat.completion.chunk", created=created, model=engine,
+                                  choices=[Choice(index=0, delta=ChoiceDelta(content=content[i:i + piece_size]), finish_reason=None)])
+    yield ChatCompletionChunk(id="cache", object="chat.completion.chunk", created=created, model=engine,
+                              choices=[Choice(index=0, delta=ChoiceDelta(), finish_reason="stop")])
+
+class ResponseCache:
+    '''
+    Two-tier cache of completed responses: an in-memory LRU and an optional on-disk SQLite tier.
+    Both tiers expire entries after ttl seconds and are bounded in size, evicting least recently used first.
+    '''
+    def __init__(self, max_entries=256, ttl=3600.0, db_path=None, max_db_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                             "created REAL NOT NULL, accessed REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+            self._db.commit()
+
+    def get(self, key):
+        '''
+        Returns the cached response text for key, or None if it is missing or expired.
+        '''
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT content, created FROM completions WHERE key = ? AND created >= ?",
+                                       (key, now - self.ttl)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, content):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, content)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO completions (key, content, created, accessed) VALUES (?, ?, ?, ?)",
+                                 (key, content, now, now))
+                self._db.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl,))
+                self._db.execute("DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                                 (self.max_db_entries,))
+                self._db.commit()
+            self.stats["stores"] += 1
+
+    def _remember(self, key, created, content):
+        self._memory[key] = (created, content)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def hit_rate(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return hits / lookups if lookups else 0.0
+
+    def record(self, key, stream):
+        '''
+        Passes a live stream through unchanged and stores the response once it completes normally.
+        Streams that error or are abandoned part way are not cached.
+        '''
+        parts = []
+        finished = False
+        for chunk in stream:
+            if chunk.choices:
+                parts.append(chunk.choices[0].delta.content or "")
+                finished = finished or chunk.choices[0].finish_reason in ("stop", "length")
+            yield chunk
+        if finished:
+            self.put(key, "".join(parts))
+
+    def completion(self, key, engine, create, on_hit=None):
+        '''
+        Returns a stream for the request: a replay of the cached response on a hit, otherwise the
+        stream from create() recorded into the cache as it is consumed. on_hit is called on a hit,
+        e.g. to account for a turn answered without a request.
+        '''
+        content = self.get(key)
+        if content is not None:
+            if on_hit is not None:
+                on_hit()
+            return replay_chunks(content, engine)
+        return self.record(key, create())
+
+def get_response_cache():
+    '''
+    Returns the process-wide response cache, configured from the RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_DB and RESPONSE_CACHE_MAX_DB_ENTRIES environment variables. The SQLite tier is only used
+    when RESPONSE_CACHE_DB is set.
+    '''
+    return shared("response_cache",
+                  lambda: ResponseCache(max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256)),
+                                        ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 3600)),
+                                        db_path=os.environ.get('RESPONSE_CACHE_DB'),
+                                        max_db_entries=int(os.environ.get('RESPONSE_CACHE_MAX_DB_ENTRIES', 10000))))
@@ -0,0 +1,244 @@
+import os, threading, time
+from collections import deque
+import openai
+from src import aoai_helpers as helpers
+from src import aoai_rate_limiter as rate_limiter
+from src.aoai_shared import shared
+
+# ############################################################
+# Multi-endpoint / multi-deployment routing
+# ############################################################
+class Backend:
+    '''
+    One endpoint + deployment able to serve a logical model, with the health statistics used to route to it.
+    '''
+    # Assumed time to first chunk for a backend that has failed without ever answering
+    FAILED_LATENCY = 60.0
+
+    def __init__(self, name, endpoint, api_key, api_version, deployment, limiter, client=None, latency_alpha=0.3, window=20):
+        self.name = name
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.api_version = api_version
+        self.deployment = deployment
+        self.limiter = limiter
+        self.client = client
+        self.latency_alpha = latency_alpha
+        self.latency = None  # exponentially weighted time to first chunk, seconds
+        self.outcomes = deque(maxlen=window)  # True for success, False for failure
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+
+    @property
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def quota_remaining(self):
+        '''
+        Fraction of the tokens/min bucket currently available.
+        '''
+        return self.limiter.quota_remaining()
+
+    def healthy(self, now):
+        # A limiter paused by a 429 won't admit anything until its Retry-After has passed
+        return now >= self.cooldown_until and self.limiter.paused_remaining() <= 0
+
+    def available_at(self, now):
+        return max(self.cooldown_until, now + self.limiter.paused_remaining())
+
+    def score(self):
+        '''
+        Lower is better: expected latency inflated by recent errors, queued work and a drained quota.
+        Backends with no latency observations yet score as fast so they get probed, unless they have only failed.
+        '''
+        if self.latency is not None:
+            latency = self.latency
+        else:
+            # Latency is only set by a success, so any outcome at all means every attempt so far failed
+            latency = self.FAILED_LATENCY if self.outcomes else 0.0
+        return ((latency + 0.05) * (1 + 4 * self.error_rate) * (1 + self.in_flight + self.limiter.queued)
+                / max(self.quota_remaining, 0.05))
+
+    def record_success(self, latency):
+        self.latency = latency if self.latency is None else self.latency_alpha * latency + (1 - self.latency_alpha) * self.latency
+        self.outcomes.append(True)
+
+    def record_failure(self, cooldown):
+        self.outcomes.append(False)
+        # Two failures in a row take the backend out of rotation for a while
+        if len(self.outcomes) >= 2 and not self.outcomes[-2]:
+            self.cooldown_until = time.monotonic() + cooldown
+
+    def snapshot(self, now):
+        return {"name": self.name,
+                "deployment": self.deployment,
+                "endpoint": self.endpoint,
+                "latency": None if self.latency is None else round(self.latency, 3),
+                "error_rate": round(self.error_rate, 3),
+                "quota_remaining": round(self.quota_remaining, 3),
+                "in_flight": self.in_flight,
+                "queued": self.limiter.queued,
+                "healthy": self.healthy(now),
+                "score": round(self.score(), 3)}
+
+class Router:
+    '''
+    Routes completions for one logical model across a pool of backends, picking the lowest scoring
+    healthy backend and failing over to the next one if a request fails before its first chunk.
+    The most recent routing decisions are kept in decisions for inspection.
+    '''
+    FAILOVER_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                       openai.InternalServerError, rate_limiter.RateLimitQueueFullError)
+
+    def __init__(self, engine, backends, cooldown=30.0, max_decisions=100):
+        self.engine = engine
+        self.backends = backends
+        self.cooldown = cooldown
+        self.decisions = deque(maxlen=max_decisions)
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        '''
+        Returns the best backend not in exclude, preferring healthy ones, or None if all are excluded.
+        '''
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        healthy = [b for b in candidates if b.healthy(now)]
+        if healthy:
+            return min(healthy, key=lambda b: b.score())
+        # Everything is cooling down or paused, so try whichever comes back first
+        return min(candidates, key=lambda b: b.available_at(now))
+
+    def snapshot(self):
+        now = time.monotonic()
+        return [b.snapshot(now) for b in self.backends]
+
+    def _record_decision(self, backend, attempt, outcome, detail=""):
+        self.decisions.append({"time": time.time(),
+                               "engine": self.engine,
+                               "backend": backend.name,
+                               "attempt": attempt,
+                               "outcome": outcome,
+                               "detail": detail})
+
+    def generate_chat_completion(self, messages, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, stop,
+                                 estimated_tokens=0, tools=None, tool_choice=None):
+        '''
+        Streams a chat completion from the best available backend, mirroring helpers.generate_chat_completion.
+
+        The stream is opened and its first chunk read before returning, so a backend that fails before
+        answering is failed over transparently and errors surface here rather than mid-iteration.
+        '''
+        tried = []
+        last_error = None
+        while True:
+            backend = self.choose(exclude=tried)
+            if backend is None:
+                if last_error is None:
+                    raise ValueError(f"No backends are configured for engine {self.engine}.")
+                raise last_error
+            tried.append(backend)
+            with self._lock:
+                backend.in_flight += 1
+            start = time.monotonic()
+            stream = None
+            try:
+                stream = helpers.generate_chat_completion(client=backend.client,
+                                                          engine=backend.deployment,
+                                                          messages=messages,
+                                                          temperature=temperature,
+                                                          max_tokens=max_tokens,
+                                                          top_p=top_p,
+                                                          frequency_penalty=frequency_penalty,
+                                                          presence_penalty=presence_penalty,
+                                                          stop=stop,
+                                                          stream=True,
+                                                          limiter=backend.limiter,
+                                                          estimated_tokens=estimated_tokens,
+                                                          tools=tools,
+                                                          tool_choice=tool_choice)
+                iterator = iter(stream)
+                first_chunk = next(iterator, None)
+            except self.FAILOVER_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    # Keep every session off this backend until its Retry-After has passed
+                    retry_after = rate_limiter.retry_after_seconds(e)
+                    backend.limiter.pause(retry_after if retry_after is not None else rate_limiter.backoff_delay(0, backend.limiter.base_delay))
+                with self._lock:
+                    backend.in_flight -= 1
+                    backend.record_failure(self.cooldown)
+                self._record_decision(backend, len(tried), "failover", type(e).__name__)
+                last_error = e
+                continue
+            except BaseException as e:
+                # e.g. a content filter 400 or an unknown deployment: another backend would answer the same,
+                # so it is raised as is, without counting against this backend's health
+                if stream is not None:
+                    stream.close()
+                with self._lock:
+                    backend.in_flight -= 1
+                self._record_decision(backend, len(tried), "failed", type(e).__name__)
+                raise
+            with self._lock:
+                backend.record_success(time.monotonic() - start)
+            self._record_decision(backend, len(tried), "routed", f"score {backend.score():.3f}")
+            return self._stream(backend, stream, first_chunk, iterator)
+
+    def _stream(self, backend, stream, first_chunk, iterator):
+        try:
+            if first_chunk is not None:
+                yield first_chunk
+            for chunk in iterator:
+                yield chunk
+        except self.FAILOVER_ERRORS as e:
+            # Too late to fail over once text has been shown, but the next request should avoid this backend
+            with self._lock:
+                backend.record_failure(self.cooldown)
+            self._record_decision(backend, 0, "failed mid-stream", type(e).__name__)
+            raise
+        finally:
+            # Closes the connection if the caller stops reading early, e.g. when the user stops the response
+            stream.close()
+            with self._lock:
+                backend.in_flight -= 1
+
+def backends_from_config(engine, params, client_factory=None):
+    '''
+    Builds the backend pool for an engine from its model config. Each entry of params['deployments'] may set
+    name, deployment (defaults to the engine name), endpoint or endpoint_env, key_env and api_version_env,
+    plus requests_per_minute / tokens_per_minute overrides. Without a deployments list the engine is served
+    by a single backend on APIM_ENDPOINT.
+    '''
+    client_factory = client_factory or helpers.get_async_aoai_client
+    deployments = params.get('deployments') or [{"name": "default"}]
+    backends = []
+    for i, spec in enumerate(deployments):
+        endpoint = spec.get('endpoint') or os.environ[spec.get('endpoint_env', 'APIM_ENDPOINT')]
+        api_key = os.environ[spec.get('key_env', 'APIM_KEY')]
+        api_version = os.environ.get(spec.get('api_version_env', 'AOAI_API_VERSION'), '2023-12-01-preview')
+        deployment = spec.get('deployment', engine)
+        # With alternatives the router fails over at once instead of the limiter retrying a struggling backend
+        limiter = rate_limiter.get_limiter(f"{endpoint}|{deployment}",
+                                           spec.get('requests_per_minute', params['requests_per_minute']),
+                                           spec.get('tokens_per_minute', params['tokens_per_minute']),
+                                           params['max_queued_requests'],
+                                           max_retries=0 if len(deployments) > 1 else 5)
+        backends.append(Backend(name=spec.get('name', f"{deployment}-{i}"),
+                                endpoint=endpoint,
+                                api_key=api_key,
+                                api_version=api_version,
+                                deployment=deployment,
+                                limiter=limiter,
+                                client=client_factory(endpoint, api_key, api_version)))
+    return backends
+
+def get_router(engine, params):
+    '''
+    Returns the process-wide router for an engine, creating it from the model config on first use.
+    '''
+    # Keyed on the deployments too so an edited config builds a new pool
+    return shared(("router", engine, repr(params.get('deployments'))),
+                  lambda: Router(engine, backends_from_config(engine, params)))
@@ -0,0 +1,19 @@
+import threading
+
+# ############################################################
+# Process-wide instances shared by every session
+# ############################################################
+_INSTANCES = {}
+_INSTANCES_LOCK = threading.RLock()  # re-entrant: a factory may fetch other shared instances, e.g. a router its limiters
+
+def shared(key, factory):
+    '''
+    Returns the process-wide instance stored under key, calling factory() to create it on first use.
+    Keys are namespaced by the caller, e.g. ("limiter", deployment).
+    '''
+    with _INSTANCES_LOCK:
+        instance = _INSTANCES.get(key)
+        if instance is None:
+            instance = factory()
+            _INSTANCES[key] = instance
+        return instance
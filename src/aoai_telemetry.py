@@ -0,0 +1,228 @@
+import json, os, queue, sys, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src import aoai_usage as usage
+from src.aoai_shared import shared
+
+# ############################################################
+# Latency and throughput telemetry
+# ############################################################
+QUANTILES = (0.5, 0.95)
+
+def quantile(values, q):
+    '''
+    Returns the q quantile of values by linear interpolation, None if there are none.
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+class MetricsRegistry:
+    '''
+    Keeps the most recent observations of each metric per deployment, for p50/p95 summaries, plus running counters.
+    '''
+    def __init__(self, window=1000):
+        self.window = window
+        self._observations = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, deployment, value):
+        with self._lock:
+            series = self._observations.get((name, deployment))
+            if series is None:
+                series = self._observations[(name, deployment)] = deque(maxlen=self.window)
+            series.append(value)
+
+    def increment(self, name, deployment, amount=1):
+        with self._lock:
+            self._counters[(name, deployment)] = self._counters.get((name, deployment), 0) + amount
+
+    def summary(self, deployment=None):
+        '''
+        Returns one row per metric and deployment with its count and quantiles, optionally for one deployment only.
+        '''
+        with self._lock:
+            series = {key: list(values) for key, values in self._observations.items()}
+        rows = []
+        for (name, label), values in sorted(series.items()):
+            if deployment is not None and label != deployment:
+                continue
+            row = {"metric": name, "deployment": label, "count": len(values)}
+            for q in QUANTILES:
+                value = quantile(values, q)
+                row[f"p{int(q * 100)}"] = None if value is None else round(value, 4)
+            rows.append(row)
+        return rows
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def prometheus_text(self):
+        '''
+        Renders the registry in the Prometheus text exposition format: each metric as a summary with
+        quantile labels over its recent window, and counters as counters.
+        '''
+        lines = []
+        for row in self.summary():
+            metric = f"aoai_{row['metric']}"
+            for q in QUANTILES:
+                value = row[f"p{int(q * 100)}"]
+                if value is not None:
+                    lines.append(f'{metric}{{deployment="{row["deployment"]}",quantile="{q}"}} {value}')
+            lines.append(f'{metric}_count{{deployment="{row["deployment"]}"}} {row["count"]}')
+        for (name, deployment), value in sorted(self.counters().items()):
+            lines.append(f'aoai_{name}_total{{deployment="{deployment}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+class JsonLinesExporter:
+    '''
+    Writes each request's metrics as a JSON line to a file, or stdout for "-", from a background thread so the
+    request path never waits on I/O. Records are dropped rather than blocking if the queue fills up.
+    '''
+    def __init__(self, path="-", max_queue=10000):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._run, name="telemetry-export", daemon=True).start()
+
+    def export(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        output = sys.stdout if self.path == "-" else open(self.path, "a", encoding="utf-8")
+        while True:
+            record = self._queue.get()
+            output.write(json.dumps(record) + "\n")
+            if self._queue.empty():
+                output.flush()
+
+class PrometheusExporter:
+    '''
+    Serves the registry at /metrics on the given port from a background thread.
+    '''
+    def __init__(self, registry, port=9464):
+        registry_ref = registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry_ref.prometheus_text().encode("utf-8")
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name="telemetry-prometheus", daemon=True).start()
+
+    def export(self, record):
+        pass  # scraped from the registry instead
+
+class Telemetry:
+    '''
+    Records per-request streaming metrics and script timings into a registry and hands each request record to an
+    optional exporter.
+    '''
+    def __init__(self, exporter=None, window=1000):
+        self.registry = MetricsRegistry(window)
+        self.exporter = exporter
+
+    def observe(self, name, deployment, value):
+        self.registry.observe(name, deployment, value)
+
+    def record_request(self, record):
+        deployment = record["deployment"]
+        self.registry.increment("requests", deployment)
+        if record.get("error"):
+            self.registry.increment("errors", deployment)
+        if record.get("cancelled"):
+            self.registry.increment("cancelled", deployment)
+        # Running token totals per deployment, for cost tracking, of the requests that got a response
+        for name in ("prompt_tokens", "completion_tokens"):
+            if record.get("usage_source") and record.get(name):
+                self.registry.increment(name, deployment, record[name])
+        for name in ("ttft_seconds", "total_seconds", "mean_inter_chunk_seconds", "max_inter_chunk_seconds",
+                     "completion_tokens_per_second", "prompt_tokens", "completion_tokens"):
+            if record.get(name) is not None:
+                self.registry.observe(name, deployment, record[name])
+        if self.exporter is not None:
+            self.exporter.export(record)
+
+    def timed_stream(self, create, deployment, prompt_tokens=None, model=None, records=None, stream_usage=None):
+        '''
+        Opens a stream with create() and passes its chunks through, timing the request from the moment it is
+        opened: time to first token, gaps between content chunks, total time and completion tokens/sec.
+        Token usage is counted as the stream goes (see aoai_usage.StreamUsage), with usage_source saying whether
+        it came from the service or was estimated from prompt_tokens and the streamed text. Pass a StreamUsage
+        as stream_usage to read the counts too (it then takes the place of model and prompt_tokens).
+        The record is written when the stream ends, errors or is closed early (marked cancelled), and also
+        appended to records if a list is given, e.g. to keep a session's own history.
+        '''
+        start = time.monotonic()
+        record = {"time": time.time(), "deployment": deployment, "prompt_tokens": prompt_tokens, "error": None, "cancelled": False}
+        stream_usage = stream_usage or usage.StreamUsage(model, prompt_tokens)
+        record["prompt_tokens"] = stream_usage.prompt_tokens
+        last = None
+        gaps = []
+        try:
+            for chunk in create():
+                stream_usage.add(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    now = time.monotonic()
+                    if last is None:
+                        record["ttft_seconds"] = now - start
+                    else:
+                        gaps.append(now - last)
+                    last = now
+                yield chunk
+        except GeneratorExit:
+            record["cancelled"] = True
+            raise
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.monotonic()
+            record["total_seconds"] = end - start
+            if gaps:
+                record["mean_inter_chunk_seconds"] = sum(gaps) / len(gaps)
+                record["max_inter_chunk_seconds"] = max(gaps)
+            if stream_usage.chunks:
+                record["prompt_tokens"] = stream_usage.prompt_tokens
+                record["usage_source"] = stream_usage.source
+            if stream_usage.completion_tokens:
+                record["completion_tokens"] = stream_usage.completion_tokens
+                if "ttft_seconds" in record and end - start > record["ttft_seconds"]:
+                    record["completion_tokens_per_second"] = record["completion_tokens"] / (end - start - record["ttft_seconds"])
+            self.record_request(record)
+            if records is not None:
+                records.append(record)
+
+def _create_telemetry():
+    telemetry = Telemetry()
+    exporter = os.environ.get('TELEMETRY_EXPORTER', '').lower()
+    if exporter == "prometheus":
+        telemetry.exporter = PrometheusExporter(telemetry.registry, int(os.environ.get('TELEMETRY_PROMETHEUS_PORT', 9464)))
+    elif exporter == "jsonl":
+        telemetry.exporter = JsonLinesExporter(os.environ.get('TELEMETRY_JSONL_PATH', '-'))
+    return telemetry
+
+def get_telemetry():
+    '''
+    Returns the process-wide telemetry, with the exporter chosen by TELEMETRY_EXPORTER: "prometheus" serves
+    /metrics on TELEMETRY_PROMETHEUS_PORT (default 9464), "jsonl" appends records to TELEMETRY_JSONL_PATH
+    (default "-", stdout), and unset keeps metrics in memory for the sidebar panel only.
+    '''
+    return shared("telemetry", _create_telemetry)
@@ -0,0 +1,125 @@
+import hashlib, threading
+from collections import OrderedDict
+from src import aoai_helpers as helpers
+
+# ############################################################
+# Per-message token memo shared by every session in the process
+# ############################################################
+_MESSAGE_TOKENS = OrderedDict()
+_MESSAGE_TOKENS_LOCK = threading.Lock()
+MAX_MEMO_ENTRIES = 20000
+
+def _message_key(message, model):
+    '''
+    Builds the memo key for a message: the resolved tiktoken model plus a digest of the message fields,
+    so large message bodies are not kept alive by the memo itself.
+    '''
+    digest = hashlib.sha1()
+    for key, value in message.items():
+        digest.update(key.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(str(value).encode("utf-8"))
+        digest.update(b"\x00")
+    return (model, digest.hexdigest())
+
+def message_tokens(message, model):
+    '''
+    Returns the token count for a single message (excluding reply priming), memoized by content hash and model.
+    '''
+    key = _message_key(message, model)
+    with _MESSAGE_TOKENS_LOCK:
+        tokens = _MESSAGE_TOKENS.get(key)
+        if tokens is not None:
+            _MESSAGE_TOKENS.move_to_end(key)
+            return tokens
+    tokens = helpers.num_tokens_from_message(message, model)
+    remember_message_tokens(message, model, tokens)
+    return tokens
+
+def remember_message_tokens(message, model, tokens):
+    '''
+    Stores a count that is already known, e.g. from a response's usage, so the message is never encoded.
+    '''
+    with _MESSAGE_TOKENS_LOCK:
+        _MESSAGE_TOKENS[_message_key(message, model)] = tokens
+        while len(_MESSAGE_TOKENS) > MAX_MEMO_ENTRIES:
+            _MESSAGE_TOKENS.popitem(last=False)
+
+# ############################################################
+# Token ledger kept alongside st.session_state.messages
+# ############################################################
+class TokenLedger:
+    '''
+    Running per-role token totals for a conversation.
+
+    The ledger tracks the message list it was synced against. Appends are counted in O(1); the list is only
+    recounted (from the memo, so without re-encoding) when it is replaced, shrinks, has messages trimmed from
+    its front, the system message is edited, or the model changes. Only counts are kept, not message contents,
+    so messages trimmed from memory are not kept alive by the ledger.
+    '''
+    REPLY_PRIMING_TOKENS = 3  # every reply is primed with <|start|>assistant<|message|>
+
+    def __init__(self, model=None):
+        self.reset(model)
+
+    def reset(self, model=None):
+        self.model = model
+        self._messages = None
+        self._length = 0
+        self._system_content = None  # to notice an edited system message
+        self._last = None  # the last message counted, to notice messages trimmed from the front
+        self.role_tokens = {"system": 0, "user": 0, "assistant": 0}
+
+    def append(self, message, tokens=None):
+        '''
+        Records a message appended to the tracked history. Pass tokens when the count is already known.
+        '''
+        if tokens is None:
+            tokens = message_tokens(message, self.model)
+        if self._length == 0:
+            self._system_content = message.get("content")
+        self._length += 1
+        self._last = message
+        self.role_tokens[message["role"]] = self.role_tokens.get(message["role"], 0) + tokens
+        return tokens
+
+    def append_completion(self, messages, completion_tokens):
+        '''
+        Records the assistant message just appended to messages from the completion tokens counted while it
+        streamed, so it is never encoded again. Messages before it that the ledger hasn't seen are counted as usual;
+        if messages isn't the tracked list the next sync recounts instead.
+        '''
+        if self._stale(messages, self.model):
+            return
+        for message in messages[self._length:-1]:
+            self.append(message)
+        model, tokens_per_message, _ = helpers.message_token_params(self.model)
+        tokens = completion_tokens + tokens_per_message + len(helpers.get_encoding(model).encode(messages[-1]["role"]))
+        remember_message_tokens(messages[-1], self.model, tokens)
+        self.append(messages[-1], tokens=tokens)
+
+    def _stale(self, messages, model):
+        return (model != self.model
+                or messages is not self._messages
+                or len(messages) < self._length
+                or (self._length > 0 and (messages[0].get("content") is not self._system_content
+                                          or messages[self._length - 1] is not self._last)))
+
+    def sync(self, messages, model):
+        '''
+        Brings the ledger up to date with the given message list, counting only messages not yet seen.
+        '''
+        if self._stale(messages, model):
+            self.reset(model)
+            self._messages = messages
+        for message in messages[self._length:]:
+            self.append(message)
+        return self
+
+    def totals(self):
+        '''
+        Returns the system, user, assistant and total token counts, each role primed as the sidebar reports it.
+        '''
+        totals = {role: self.role_tokens.get(role, 0) + self.REPLY_PRIMING_TOKENS for role in ("system", "user", "assistant")}
+        totals["total"] = sum(totals.values())
+        return totals
@@ -0,0 +1,144 @@
+import json, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from src import aoai_helpers as helpers
+from src.aoai_shared import shared
+
+# ############################################################
+# Tool call execution
+# ############################################################
+def make_bing_web_search_tool(api_key, output_format="text"):
+    '''
+    Adapts helpers.bing_web_search to the bing_web_search tool definition, whose optional query parameters
+    arrive either as top level arguments or nested under "**kwargs". Results default to plain text since
+    the model has no use for table markup.
+    '''
+    def bing_web_search(query, **kwargs):
+        params = kwargs.pop("**kwargs", None) or {}
+        params.update(kwargs)
+        params.pop("q", None)
+        return helpers.bing_web_search(api_key, query, output_format=output_format, **params)
+    return bing_web_search
+
+# Tool calls from every session and round share one pool, so the number of threads they use stays fixed,
+# including calls that timed out and were abandoned but have not returned yet
+MAX_TOOL_WORKERS = 8
+
+def get_tool_pool():
+    '''
+    Returns the process-wide thread pool tool calls run on, with MAX_TOOL_WORKERS threads.
+    '''
+    return shared("tool_pool", lambda: ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS, thread_name_prefix="tool"))
+
+def _call_tool(function, arguments, call_id, started):
+    started[call_id] = time.monotonic()
+    return str(function(**arguments))
+
+def execute_tool_calls(tool_calls, tool_functions, timeout=30.0, pool=None):
+    '''
+    Runs tool calls concurrently on a bounded thread pool and returns one tool message per call, in call order.
+
+    Each call gets timeout seconds from when it starts running, so a call queued for a free thread is not cut
+    short, and a call that can't get a thread within timeout seconds is given up on. Unknown tools, malformed
+    arguments, errors and timeouts are reported back to the model as the tool's result instead of being raised.
+
+    Args:
+        tool_calls (list): Dicts with id, name and arguments (a JSON string), as accumulated from a stream.
+        tool_functions (dict): Tool name -> callable taking the tool's arguments as keyword arguments.
+        pool (ThreadPoolExecutor): Defaults to the process-wide pool, see get_tool_pool.
+    '''
+    pool = pool or get_tool_pool()
+    results = {}
+    futures = {}
+    started = {}  # call id -> when a thread picked the call up, written by the workers
+    for call in tool_calls:
+        function = tool_functions.get(call["name"])
+        if function is None:
+            results[call["id"]] = f"Error: unknown tool {call['name']}."
+            continue
+        try:
+            arguments = json.loads(call["arguments"] or "{}")
+        except json.JSONDecodeError as e:
+            results[call["id"]] = f"Error: the arguments were not valid JSON ({e})."
+            continue
+        futures[call["id"]] = pool.submit(_call_tool, function, arguments, call["id"], started)
+
+    submitted = time.monotonic()
+    while futures:
+        now = time.monotonic()
+        for call_id, future in list(futures.items()):
+            if future.done():
+                try:
+                    results[call_id] = future.result()
+                except Exception as e:
+                    results[call_id] = f"Error: {type(e).__name__}: {e}"
+            elif call_id in started:
+                if now - started[call_id] < timeout:
+                    continue
+                # Abandoned rather than waited for; its thread returns to the pool when the call does
+                results[call_id] = f"Error: the tool did not finish within {timeout:g} seconds."
+            elif now - submitted >= timeout and future.cancel():
+                results[call_id] = f"Error: the tool could not be started within {timeout:g} seconds."
+            else:
+                continue
+            del futures[call_id]
+        if futures:
+            deadline = min(started[call_id] + timeout if call_id in started else submitted + timeout for call_id in futures)
+            wait(futures.values(), timeout=max(deadline - time.monotonic(), 0.001), return_when=FIRST_COMPLETED)
+
+    return [{"role": "tool", "tool_call_id": call["id"], "content": results[call["id"]]}
+            for call in tool_calls]
+
+def run_with_tools(create_stream, messages, tool_functions, max_rounds=5, timeout=30.0):
+    '''
+    Streams a completion, executing any tool calls the model makes and feeding their results back until the
+    model produces a final answer.
+
+    Args:
+        create_stream (callable): Called as create_stream(messages, tool_choice) and returning a chat completion
+            stream for the messages with the tools enabled. tool_choice is "none" on the last round so the model
+            has to answer.
+        messages (list): The conversation so far. It is copied, not modified.
+        tool_functions (dict): Tool name -> callable, see execute_tool_calls.
+
+    Yields:
+        tuple: ("delta", text) as answer text streams in, ("tool_calls", calls) before tools run and
+        ("tool_results", messages) after they finish.
+    '''
+    messages = list(messages)
+    for round_number in range(max_rounds + 1):
+        tool_choice = "none" if round_number == max_rounds else "auto"
+        parts = []
+        calls = {}
+        stream = create_stream(messages, tool_choice)
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    parts.append(delta.content)
+                    yield ("delta", delta.content)
+                # Tool calls stream in fragments keyed by index: the id and name arrive first, the arguments in pieces
+                for fragment in delta.tool_calls or []:
+                    call = calls.setdefault(fragment.index, {"id": None, "name": "", "arguments": ""})
+                    if fragment.id:
+                        call["id"] = fragment.id
+                    if fragment.function is not None:
+                        call["name"] += fragment.function.name or ""
+                        call["arguments"] += fragment.function.arguments or ""
+        finally:
+            # Closing this generator early, e.g. when the user stops the response, closes the stream with it
+            stream.close()
+        if not calls:
+            return
+
+        tool_calls = [calls[index] for index in sorted(calls)]
+        yield ("tool_calls", tool_calls)
+        messages.append({"role": "assistant",
+                         "content": "".join(parts) or None,
+                         "tool_calls": [{"id": call["id"], "type": "function",
+                                         "function": {"name": call["name"], "arguments": call["arguments"]}}
+                                        for call in tool_calls]})
+        tool_messages = execute_tool_calls(tool_calls, tool_functions, timeout=timeout)
+        yield ("tool_results", tool_messages)
+        messages.extend(tool_messages)
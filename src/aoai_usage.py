@@ -0,0 +1,97 @@
+import threading, time
+from collections import deque
+from src import aoai_helpers as helpers
+
+# ############################################################
+# Token usage accounting
+# ############################################################
+def _usage_value(usage, name):
+    # Fields the pinned SDK doesn't model arrive as plain dicts
+    return usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+
+class StreamUsage:
+    '''
+    Usage of one streamed completion. Completion tokens are counted as deltas arrive, so nothing is re-encoded
+    once the stream ends, and both counts are replaced by the service's own if the stream carries a usage chunk
+    (sent when AOAI_STREAM_USAGE is set and the API version supports it). source says which it is.
+    '''
+    def __init__(self, model=None, prompt_tokens=None):
+        self.encoding = helpers.get_encoding(model) if model is not None else None
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0 if self.encoding is not None else None
+        self.source = "estimated"
+        self.chunks = 0
+
+    def add(self, chunk):
+        self.chunks += 1
+        usage = getattr(chunk, "usage", None)
+        if usage:
+            self.prompt_tokens = _usage_value(usage, "prompt_tokens")
+            self.completion_tokens = _usage_value(usage, "completion_tokens")
+            self.source = "service"
+        elif self.source == "estimated" and self.encoding is not None and chunk.choices:
+            delta = chunk.choices[0].delta
+            if delta.content:
+                self.completion_tokens += len(self.encoding.encode(delta.content))
+            for fragment in delta.tool_calls or []:
+                if fragment.function is not None and fragment.function.arguments:
+                    self.completion_tokens += len(self.encoding.encode(fragment.function.arguments))
+
+class SessionUsage:
+    '''
+    Usage of one session, built from the request records telemetry hands it (pass it as records to
+    Telemetry.timed_stream): the recent records, usage per turn, and running totals per deployment.
+    Only requests that got a response (records with a usage_source) count towards usage; a turn's source stays
+    None until one does, or is "cache" for a turn answered from the response cache without any request.
+    '''
+    def __init__(self, max_records=50, max_turns=200):
+        self.records = deque(maxlen=max_records)
+        self.turns = deque(maxlen=max_turns)
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def start_turn(self):
+        '''
+        Starts a new turn; the requests recorded until the next one, e.g. tool rounds or compared models, count towards it.
+        '''
+        with self._lock:
+            self.turns.append({"time": time.time(), "requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                               "source": None, "records": []})
+        return self.turns[-1]
+
+    def record_cache_hit(self):
+        '''
+        Marks the current turn as answered from the response cache, so no tokens were billed for it.
+        '''
+        with self._lock:
+            if self.turns and self.turns[-1]["source"] is None:
+                self.turns[-1]["source"] = "cache"
+
+    def append(self, record):
+        # Called from the compare worker threads too
+        with self._lock:
+            self.records.append(record)
+            if record.get("usage_source") is None:
+                return
+            totals = self.totals.setdefault(record["deployment"], {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            entries = [totals] + ([self.turns[-1]] if self.turns else [])
+            for entry in entries:
+                entry["requests"] += 1
+                entry["prompt_tokens"] += record.get("prompt_tokens") or 0
+                entry["completion_tokens"] += record.get("completion_tokens") or 0
+            if self.turns:
+                self.turns[-1]["records"].append(record)
+                if self.turns[-1]["source"] != "estimated":
+                    self.turns[-1]["source"] = "service" if record["usage_source"] == "service" else "estimated"
+
+    def summary(self):
+        '''
+        Returns one row per deployment with its requests and tokens, plus a total row.
+        '''
+        with self._lock:
+            rows = [{"deployment": deployment, **totals} for deployment, totals in sorted(self.totals.items())]
+        rows.append({"deployment": "total",
+                     "requests": sum(row["requests"] for row in rows),
+                     "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+                     "completion_tokens": sum(row["completion_tokens"] for row in rows)})
+        return rows
@@ -0,0 +1,118 @@
+'''
+The pooled, cached Bing search client against a local stand-in for the Bing Web Search endpoint.
+
+Run from the repository root:
+    > python -m pytest tests
+'''
+import json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+from src import aoai_bing_search as bing_search
+from src import aoai_helpers as helpers
+
+class StubBing:
+    '''
+    Answers every GET with two results for the query, after delays[query] seconds (default none), and records
+    each request's query, subscription key and client port.
+    '''
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                params = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+                with stub.lock:
+                    stub.requests.append({"params": params, "key": self.headers.get("Ocp-Apim-Subscription-Key"),
+                                          "port": self.client_address[1]})
+                time.sleep(stub.delays.get(params["q"], 0))
+                if params["q"] == "nothing":
+                    body = {"_type": "SearchResponse"}
+                else:
+                    body = {"webPages": {"value": [{"name": f"{params['q']} result {i}", "url": f"https://example.com/{i}",
+                                                    "snippet": f"About <strong>{params['q']}</strong>\nline two",
+                                                    "dateLastCrawled": "2024-01-02T03:04:05.0000000Z"} for i in range(2)]}}
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v7.0/search"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def stub_bing():
+    stubs = []
+    def start(**kwargs):
+        stubs.append(StubBing(**kwargs))
+        return stubs[-1]
+    yield start
+    for stub in stubs:
+        stub.server.shutdown()
+
+def test_structured_and_text_formats(stub_bing):
+    stub = stub_bing()
+    client = bing_search.BingSearchClient("key", base_url=stub.url)
+    items = client.search("python", output_format="structured", count=2)
+    assert items[0] == {"name": "python result 0", "url": "https://example.com/0", "snippet": "About <strong>python</strong> line two",
+                        "last_updated": "2024-01-02", "type": "Web page"}
+    text = client.search("python", output_format="text", count=2)
+    assert text.splitlines()[1] == "python result 1 (https://example.com/1, 2024-01-02): About python line two"
+    assert client.search("nothing", output_format="structured") == "No results found or the query was invalid."
+    assert stub.requests[0]["params"] == {"q": "python", "count": "2"} and stub.requests[0]["key"] == "key"
+
+def test_identical_queries_are_served_from_the_cache_until_they_expire(stub_bing):
+    stub = stub_bing()
+    client = bing_search.BingSearchClient("key", base_url=stub.url, cache_ttl=0.3)
+    assert client.search("python", output_format="html", mkt="en-US").startswith("<table>")
+    assert client.search("python", output_format="markdown", mkt="en-US").startswith("Name (URL) | Snippet")
+    client.search("python", output_format="html", mkt="en-GB")
+    # The cache holds raw results, so a different format is still a hit; different parameters are not
+    assert len(stub.requests) == 2 and client.stats == {"hits": 1, "misses": 2}
+    time.sleep(0.35)
+    client.search("python", output_format="html", mkt="en-US")
+    assert len(stub.requests) == 3
+
+def test_sequential_searches_reuse_one_pooled_connection(stub_bing):
+    stub = stub_bing()
+    client = bing_search.BingSearchClient("key", base_url=stub.url)
+    for i in range(5):
+        client.search(f"query {i}", output_format="text")
+    assert len({request["port"] for request in stub.requests}) == 1
+
+def test_search_many_runs_concurrently_and_keeps_query_order(stub_bing):
+    # The first query answers last, so arrival order differs from query order
+    stub = stub_bing(delays={"slow": 0.4, "medium": 0.2, "fast": 0.0})
+    client = bing_search.BingSearchClient("key", base_url=stub.url, pool_size=3)
+    start = time.monotonic()
+    results = client.search_many(["slow", {"query": "medium", "count": 1}, "fast"], output_format="structured")
+    assert time.monotonic() - start < 0.55
+    assert [items[0]["name"] for items in results] == ["slow result 0", "medium result 0", "fast result 0"]
+    assert {request["params"]["q"]: request["params"].get("count") for request in stub.requests}["medium"] == "1"
+    assert len({request["port"] for request in stub.requests}) <= client.pool_size
+
+def test_errors_are_returned_as_messages(stub_bing):
+    stub = stub_bing()
+    client = bing_search.BingSearchClient("key", base_url=stub.url, timeout=1.0)
+    stub.server.shutdown()
+    stub.server.server_close()
+    assert client.search("python").startswith("Error: ")
+
+def test_bing_web_search_uses_the_endpoint_from_the_environment(stub_bing, monkeypatch):
+    stub = stub_bing()
+    monkeypatch.setenv("BING_SEARCH_ENDPOINT", stub.url)
+    items = helpers.bing_web_search("env-key", "python", output_format="structured")
+    assert [item["name"] for item in items] == ["python result 0", "python result 1"]
+    assert stub.requests[0]["key"] == "env-key"
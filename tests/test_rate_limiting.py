@@ -0,0 +1,141 @@
+'''
+Rate limiting, Retry-After and failover against the local stub endpoint (benchmarks/stub_aoai_server.py).
+
+Run from the repository root:
+    > python -m pytest tests
+'''
+import time
+import httpx, openai, pytest
+from benchmarks import stub_aoai_server as stub
+from src import aoai_rate_limiter as rate_limiter
+from src import aoai_router as router
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+@pytest.fixture
+def start_stub(monkeypatch):
+    monkeypatch.setenv("APIM_KEY", "stub")
+    monkeypatch.setenv("AOAI_API_VERSION", "2023-12-01-preview")
+    servers = []
+    def start(**kwargs):
+        config = stub.StubConfig(**{"chunks": 5, "first_chunk_delay": 0.0, "chunk_delay": 0.0, **kwargs})
+        server = stub.start_stub_server(config)
+        servers.append(server)
+        return config, f"http://127.0.0.1:{server.server_port}"
+    yield start
+    for server in servers:
+        server.shutdown()
+
+def make_router(endpoints):
+    params = {"deployments": [{"name": name, "endpoint": endpoint} for name, endpoint in endpoints],
+              "requests_per_minute": 1000, "tokens_per_minute": 1000000, "max_queued_requests": 8}
+    return router.Router("gpt-35-turbo", router.backends_from_config("gpt-35-turbo", params))
+
+def complete(model_router):
+    stream = model_router.generate_chat_completion(messages=MESSAGES, temperature=0.0, max_tokens=50, top_p=1.0,
+                                                   frequency_penalty=0.0, presence_penalty=0.0, stop=None, estimated_tokens=60)
+    return "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+
+class RateLimitResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+class RateLimitError(Exception):
+    def __init__(self, headers):
+        self.response = RateLimitResponse(headers)
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "250", "retry-after": "1"}, 0.25),
+    ({}, None),
+    ({"retry-after": "soon"}, None),
+])
+def test_retry_after_seconds(headers, expected):
+    assert rate_limiter.retry_after_seconds(RateLimitError(headers)) == expected
+
+def test_pause_holds_every_caller():
+    now = [0.0]
+    limiter = rate_limiter.DeploymentLimiter(1000, 1000000, clock=lambda: now[0])
+    limiter.pause(2.0)
+    assert limiter.paused_remaining() == 2.0
+    with pytest.raises(TimeoutError):
+        limiter.acquire(10, timeout=0)
+    now[0] = 2.0
+    assert limiter.paused_remaining() == 0
+    limiter.acquire(10, timeout=0)
+
+def test_single_backend_retries_after_retry_after(start_stub):
+    config, endpoint = start_stub(rate_limit_first=1, retry_after_ms=300)
+    model_router = make_router([("only", endpoint)])
+    start = time.monotonic()
+    assert complete(model_router) == "xxx " * 5
+    # The limiter waited out at least the Retry-After before the second attempt
+    assert time.monotonic() - start >= 0.3
+    assert config.stats["requests"] == 2 and config.stats["rate_limited"] == 1
+    limiter = model_router.backends[0].limiter
+    assert limiter.stats["retries"] == 1 and limiter.stats["throttled"] == 1
+
+def test_failover_on_429_is_immediate(start_stub):
+    throttled_config, throttled_endpoint = start_stub(rate_limit_fraction=1.0, retry_after_ms=5000)
+    healthy_config, healthy_endpoint = start_stub()
+    model_router = make_router([("throttled", throttled_endpoint), ("healthy", healthy_endpoint)])
+    throttled, healthy = model_router.backends
+
+    start = time.monotonic()
+    assert complete(model_router) == "xxx " * 5
+    # One 429 and straight on to the next backend, without retrying or waiting out the throttle
+    assert time.monotonic() - start < 2.0
+    assert throttled_config.stats["requests"] == 1
+    assert [decision["outcome"] for decision in model_router.decisions] == ["failover", "routed"]
+
+    # The Retry-After pauses the throttled backend, so it stays out of rotation for every session
+    assert throttled.limiter.paused_remaining() > 4.0
+    assert not throttled.healthy(time.monotonic())
+    assert model_router.choose() is healthy
+    assert complete(model_router) == "xxx " * 5
+    assert throttled_config.stats["requests"] == 1 and healthy_config.stats["requests"] == 2
+
+def test_failed_backend_does_not_score_as_fastest(start_stub):
+    _, first = start_stub()
+    _, second = start_stub()
+    model_router = make_router([("failed", first), ("untried", second)])
+    failed, untried = model_router.backends
+    failed.record_failure(cooldown=0)
+    assert failed.score() > untried.score()
+    assert model_router.choose() is untried
+
+def test_all_backends_throttled_raises_rate_limit_error(start_stub):
+    _, first = start_stub(rate_limit_fraction=1.0)
+    _, second = start_stub(rate_limit_fraction=1.0)
+    model_router = make_router([("a", first), ("b", second)])
+    with pytest.raises(router.Router.FAILOVER_ERRORS):
+        complete(model_router)
+    assert all(backend.limiter.paused_remaining() > 0 for backend in model_router.backends)
+
+class ContentFilterClient:
+    '''
+    Stands in for AsyncAzureOpenAI, rejecting every request the way a content filter does.
+    '''
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def create(self, **kwargs):
+        response = httpx.Response(400, request=httpx.Request("POST", "http://stub/chat/completions"))
+        raise openai.BadRequestError("The response was filtered", response=response, body=None)
+
+def test_request_error_releases_backend():
+    limiter = rate_limiter.DeploymentLimiter(1000, 1000000)
+    backend = router.Backend("filtered", "http://stub", "stub", "2023-12-01-preview", "gpt-35-turbo", limiter, client=ContentFilterClient())
+    model_router = router.Router("gpt-35-turbo", [backend])
+    for _ in range(3):
+        with pytest.raises(openai.BadRequestError):
+            complete(model_router)
+    # Not the backend's fault, so it stays healthy, but nothing is left counted as in flight
+    assert backend.in_flight == 0
+    assert list(backend.outcomes) == []
+    assert [decision["outcome"] for decision in model_router.decisions] == ["failed"] * 3
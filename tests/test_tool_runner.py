@@ -0,0 +1,110 @@
+'''
+Concurrent tool execution and the tool-call loop, with stub tools and a fake completion endpoint.
+
+Run from the repository root:
+    > python -m pytest tests
+'''
+import json, time
+from concurrent.futures import ThreadPoolExecutor
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta, ChoiceDeltaToolCall, ChoiceDeltaToolCallFunction
+from src import aoai_tool_runner as tool_runner
+
+def slow_tool(seconds):
+    def tool(query):
+        time.sleep(seconds)
+        return f"results for {query}"
+    return tool
+
+def tool_call(i, name="search", arguments=None):
+    return {"id": f"call_{i}", "name": name, "arguments": json.dumps({"query": f"q{i}"}) if arguments is None else arguments}
+
+def test_calls_run_concurrently_and_keep_call_order():
+    calls = [tool_call(i) for i in range(3)]
+    start = time.monotonic()
+    messages = tool_runner.execute_tool_calls(calls, {"search": slow_tool(0.3)})
+    # As long as the slowest call, not the sum of them
+    assert time.monotonic() - start < 0.6
+    assert [m["tool_call_id"] for m in messages] == ["call_0", "call_1", "call_2"]
+    assert [m["content"] for m in messages] == ["results for q0", "results for q1", "results for q2"]
+
+def test_timeout_counts_from_when_each_call_starts():
+    # One thread, so the second call queues behind the first; both fit in the timeout only if each is timed from its own start
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        messages = tool_runner.execute_tool_calls([tool_call(0), tool_call(1)], {"search": slow_tool(0.2)}, timeout=0.3, pool=pool)
+    assert [m["content"] for m in messages] == ["results for q0", "results for q1"]
+
+def test_slow_call_is_reported_as_timed_out():
+    start = time.monotonic()
+    messages = tool_runner.execute_tool_calls([tool_call(0)], {"search": slow_tool(1.0)}, timeout=0.2)
+    assert time.monotonic() - start < 0.8
+    assert messages[0]["content"] == "Error: the tool did not finish within 0.2 seconds."
+
+def test_call_that_never_gets_a_thread_is_given_up():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        messages = tool_runner.execute_tool_calls([tool_call(0), tool_call(1)], {"search": slow_tool(0.5)}, timeout=0.2, pool=pool)
+    assert messages[0]["content"] == "Error: the tool did not finish within 0.2 seconds."
+    assert messages[1]["content"] == "Error: the tool could not be started within 0.2 seconds."
+
+def test_bad_calls_are_reported_to_the_model():
+    def failing(query):
+        raise RuntimeError("search is down")
+    calls = [tool_call(0, name="missing"), tool_call(1, arguments="{not json"), tool_call(2, name="failing")]
+    contents = [m["content"] for m in tool_runner.execute_tool_calls(calls, {"search": slow_tool(0), "failing": failing})]
+    assert contents[0] == "Error: unknown tool missing."
+    assert contents[1].startswith("Error: the arguments were not valid JSON")
+    assert contents[2] == "Error: RuntimeError: search is down"
+
+def _chunk(delta):
+    return ChatCompletionChunk(id="fake", object="chat.completion.chunk", created=0, model="fake",
+                               choices=[Choice(index=0, delta=delta, finish_reason=None)])
+
+class FakeCompletions:
+    '''
+    Stands in for the completion endpoint: asks for tools_per_round searches whenever tools are allowed, streaming
+    each call's arguments in two fragments, and answers once tool_choice is "none".
+    '''
+    def __init__(self, tools_per_round):
+        self.tools_per_round = tools_per_round
+        self.requests = []
+        self.closed = 0
+
+    def __call__(self, messages, tool_choice):
+        self.requests.append((list(messages), tool_choice))
+        return self.stream(len(self.requests), tool_choice)
+
+    def stream(self, round_number, tool_choice):
+        try:
+            if tool_choice == "none":
+                for text in ("The ", "answer."):
+                    yield _chunk(ChoiceDelta(content=text))
+                return
+            for i in range(self.tools_per_round):
+                arguments = json.dumps({"query": f"round {round_number} search {i}"})
+                yield _chunk(ChoiceDelta(tool_calls=[ChoiceDeltaToolCall(index=i, id=f"call_{round_number}_{i}", type="function",
+                                                                         function=ChoiceDeltaToolCallFunction(name="search", arguments=arguments[:5]))]))
+                yield _chunk(ChoiceDelta(tool_calls=[ChoiceDeltaToolCall(index=i, function=ChoiceDeltaToolCallFunction(arguments=arguments[5:]))]))
+        finally:
+            self.closed += 1
+
+def test_tool_rounds_end_with_tool_choice_none():
+    completions = FakeCompletions(tools_per_round=3)
+    start = time.monotonic()
+    events = list(tool_runner.run_with_tools(completions, [{"role": "user", "content": "Hi"}], {"search": slow_tool(0.2)}, max_rounds=2))
+    # Two rounds of three concurrent 0.2s searches
+    assert time.monotonic() - start < 1.0
+    assert [tool_choice for _, tool_choice in completions.requests] == ["auto", "auto", "none"]
+    assert [event for event, _ in events] == ["tool_calls", "tool_results", "tool_calls", "tool_results", "delta", "delta"]
+    assert events[0][1][2] == {"id": "call_1_2", "name": "search", "arguments": '{"query": "round 1 search 2"}'}
+    # The last request carries both rounds: an assistant tool call message followed by its three results, each time
+    last_messages = completions.requests[-1][0]
+    assert [m["role"] for m in last_messages] == ["user"] + ["assistant", "tool", "tool", "tool"] * 2
+    assert last_messages[2]["content"] == "results for round 1 search 0"
+    assert completions.closed == 3
+
+def test_closing_the_loop_closes_the_stream():
+    completions = FakeCompletions(tools_per_round=0)
+    events = tool_runner.run_with_tools(completions, [{"role": "user", "content": "Hi"}], {}, max_rounds=0)
+    assert next(events) == ("delta", "The ")
+    events.close()
+    assert completions.closed == 1